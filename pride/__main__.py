@@ -7,14 +7,26 @@ version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 license."""
 
 def run ():
+    import argparse
     import curses
 
+    from pride import ui
     from pride.app import Pride
 
+    parser = argparse.ArgumentParser (description = 'A command-line Python IDE suitable for use over SSH')
+    parser.add_argument ('--output', choices = ['curses', 'ansi'], default = 'curses', help = 'how to draw to the terminal')
+    parser.add_argument ('--log-refresh', action = 'store_true', help = 'log the cells and bytes written each refresh to debug.log')
+    args = parser.parse_args ()
+
     def main (screen):
         curses.start_color ()
         curses.use_default_colors ()
-        pride = Pride (screen)
+        if args.output == 'ansi':
+            output = ui.AnsiOutput (screen)
+        else:
+            output = ui.CursesOutput (screen)
+        pride = Pride (screen, output)
+        pride.display.log_stats = args.log_refresh
         pride.run ()
 
     curses.wrapper (main)
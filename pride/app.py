@@ -10,6 +10,8 @@ license."""
 
 import asyncio
 import curses
+import os
+import threading
 import unicodedata
 import pathlib
 
@@ -70,6 +72,10 @@ class HelpDialog (ui.Box):
         grid.append_row (label)
         label = ui.Label ('Insert - Insert Emoji', '#000000')
         grid.append_row (label)
+        label = ui.Label ('Ctrl+F - Find and replace', '#000000')
+        grid.append_row (label)
+        label = ui.Label ('Ctrl+G - Find next', '#000000')
+        grid.append_row (label)
 
         python_logo = PythonLogo ()
         grid.append_row (python_logo)
@@ -96,10 +102,68 @@ class MenuDialog (ui.Box):
         grid.append_row (button)
 
     def _new_file_clicked (self):
-        self.visible = False
+        self.set_visible (False)
 
     def _options_clicked (self):
-        self.visible = False
+        self.set_visible (False)
+
+class SearchField (ui.Widget):
+    def __init__ (self, editor):
+        ui.Widget.__init__ (self)
+        self.editor = editor
+        self.query = ''
+        self.replacement = ''
+        self.editing_replacement = False
+        self.set_scale (1.0, 0.0)
+
+    def get_size (self):
+        return (20, 3)
+
+    def handle_character_event (self, event):
+        if self.editing_replacement:
+            self.replacement += chr (event.character)
+        else:
+            self.query += chr (event.character)
+            self.editor.get_file_view ().find (self.query)
+        self.invalidate ()
+        return True
+
+    def handle_key_event (self, event):
+        file_view = self.editor.get_file_view ()
+        if event.key == ui.Key.BACKSPACE:
+            if self.editing_replacement:
+                self.replacement = self.replacement[:-1]
+            else:
+                self.query = self.query[:-1]
+                file_view.find (self.query)
+        elif event.key == ui.Key.TAB:
+            self.editing_replacement = not self.editing_replacement
+        elif event.key == ui.Key.ENTER or event.key == ui.Key.DOWN:
+            file_view.find_next ()
+        elif event.key == ui.Key.UP:
+            file_view.find_previous ()
+        elif event.key == ui.Key.CTRL_R:
+            file_view.replace_all (self.replacement)
+        else:
+            return False
+        self.invalidate ()
+        return True
+
+    def render (self, frame, theme):
+        n_matches = self.editor.get_file_view ().search.get_n_matches ()
+        frame.render_text (0, 0, 'Find: ' + self.query, '#000000')
+        frame.render_text (0, 1, 'Replace: ' + self.replacement, '#000000')
+        frame.render_text (0, 2, '{} matches, Tab - Replace, Ctrl+R - Replace all'.format (n_matches), theme.dim_text_color)
+        if self.editing_replacement:
+            frame.cursor = (len ('Replace: ' + self.replacement), 1)
+        else:
+            frame.cursor = (len ('Find: ' + self.query), 0)
+
+class SearchDialog (ui.Box):
+    def __init__ (self, editor):
+        ui.Box.__init__ (self, background = '#FFFFFF')
+        self.field = SearchField (editor)
+        self.set_child (self.field)
 
 class FileDialog (ui.Box):
     def __init__ (self, callback = None):
@@ -120,54 +184,226 @@ class FileDialog (ui.Box):
     def _file_selected (self, item):
         self.callback (item)
 
+# Files larger than this are mapped into memory and loaded in the background
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+
+# Amount of a large file to load in each step
+_LOAD_STEP_SIZE = 4 * 1024 * 1024
+
+# Amount of a large file to check for its encoding and newline style
+_DETECT_SIZE = 64 * 1024
+
+# Time to wait after changes before saving. Changes are kept in a journal
+# until then, so this can be long.
+_AUTOSAVE_DELAY = 10.0
+
+# Time to wait before saving files that don't have a journal yet
+_UNJOURNALED_AUTOSAVE_DELAY = 1.0
+
 class FileView (ui.Grid):
     def __init__ (self, path):
         ui.Grid.__init__ (self)
 
         self.path = path
 
-        self.buffer = ui.TextBuffer (changed_callback = self._file_changed)
+        self.buffer = ui.TextBuffer (changed_callback = self._file_changed, storage = ui.LineRope)
         self.save_handle = None
-        self.view = ui.TextView (self.buffer)
+        self.view = ui.TextView (self.buffer, scrolled_callback = self._view_scrolled)
         self.append_column (self.view)
         self.scroll = ui.Scroll ()
         self.append_column (self.scroll)
+        # The text view and scroll bar cover the whole area
+        self.opaque = True
 
         self.focus (self.view)
-
+        if path.endswith ('.py'):
+            self.view.set_highlighter (ui.PythonHighlighter (self.buffer))
+        self.search = ui.SearchIndex (self.buffer)
+        self.view.set_search_index (self.search)
+
+        # Version of the buffer and hash of the contents last written to disk.
+        # Saves happen in another thread, save_lock is held while writing.
+        self.save_lock = threading.Lock ()
+        self.saved_version = self.buffer.version
+        self.saved_hash = None
+
+        # Files are written back in the format they were read in
+        self.encoding = 'utf-8'
+        self.newline = '\n'
+
+        self.load_handle = None
+        self.journal = None
         try:
-            for line in open (path).read ().split ('\n'):
-                self.buffer.lines.append (line)
-        except:
-            pass
+            large = os.path.getsize (path) >= LARGE_FILE_SIZE
+            if large:
+                (self.encoding, self.newline) = ui.detect_format (open (path, 'rb').read (_DETECT_SIZE))
+            # Only files split by b'\n' can be mapped
+            if large and not self.encoding.startswith ('utf-16') and self.newline != '\r':
+                self.buffer.lines = ui.MappedLines (path, self.encoding, self.newline)
+                self.buffer.lines.index (_LOAD_STEP_SIZE)
+                self.load_handle = asyncio.get_event_loop ().call_soon (self._load_step)
+            else:
+                lines = []
+                (self.encoding, self.newline) = ui.read_lines (path, lines)
+                self.buffer.lines = ui.LineRope (lines)
+                self.saved_hash = ui.get_lines_hash (self.buffer.lines, self.encoding, self.newline)
+        except FileNotFoundError:
+            # Make sure the file is created on the first save
+            self.saved_version = -1
+        except (OSError, UnicodeError) as e:
+            open ('debug.log', 'a').write ('Failed to load {}: {}\n'.format (path, e))
+            raise
+
+        # Recover changes that weren't saved.
+        # Large files are journaled once they have loaded.
+        if self.load_handle is None:
+            self._open_journal (ui.get_lines_hash (self.buffer.lines, self.encoding, self.newline))
+            self.journal.replay ()
+
+    # Journal changes made after the version of the file with the given hash
+    def _open_journal (self, lines_hash):
+        (directory, filename) = os.path.split (self.path)
+        journal_path = os.path.join (directory, '.' + filename + '.journal')
+        self.journal = ui.Journal (journal_path, self.buffer, lines_hash)
+
+    def _load_step (self):
+        self._index_lines (_LOAD_STEP_SIZE)
+        if self.buffer.lines.complete:
+            self.load_handle = None
+            self._loaded ()
+        else:
+            self.load_handle = asyncio.get_event_loop ().call_soon (self._load_step)
 
-    def save (self):
-        f = open (self.path, 'w')
-        f.write ('\n'.join (self.buffer.lines))
-        f.close ()
+    # Can't save until we have the whole file
+    def _finish_loading (self):
+        if self.load_handle is None:
+            return
+        self.load_handle.cancel ()
+        self.load_handle = None
+        self._index_lines ()
+        self._loaded ()
+
+    def _loaded (self):
+        # The journal is made against the file on disk, so can't be used if
+        # the text was changed while loading. It is opened on the next save.
+        if self.saved_version != self.buffer.version:
+            return
+        self.saved_hash = ui.get_lines_hash (self.buffer.lines, self.encoding, self.newline)
+        self._open_journal (self.saved_hash)
+        self.journal.replay ()
+
+    # Add lines from the next max_bytes of a mapped file, or the rest of it
+    def _index_lines (self, max_bytes = None):
+        n_lines = len (self.buffer.lines)
+        n_added = self.buffer.lines.index (max_bytes)
+        if n_added > 0:
+            # Lines from the file are already saved
+            unchanged = self.saved_version == self.buffer.version
+            self.buffer.notify_changed (ui.TextChange (ui.ChangeKind.LINES, n_lines, n_lines + n_added, n_added))
+            if unchanged:
+                self.saved_version = self.buffer.version
 
-    def _file_changed (self):
+    def save (self):
+        self._finish_loading ()
+        result = self._write_lines (self.buffer.version, self.buffer.lines)
+        if result is not None:
+            self._saved (*result)
+
+    def _saved (self, version, lines_hash):
+        if self.journal is None and self.load_handle is None and version == self.buffer.version:
+            self._open_journal (lines_hash)
+        if self.journal is not None:
+            self.journal.saved (version, lines_hash)
+
+    # Write the lines from a version of the buffer, skipping it if a newer version
+    # has been saved or if the contents are the same as on disk.
+    # Returns the version and hash now on disk, or None if skipped.
+    def _write_lines (self, version, lines):
+        with self.save_lock:
+            if version <= self.saved_version:
+                return None
+            try:
+                lines_hash = ui.get_lines_hash (lines, self.encoding, self.newline)
+            except UnicodeEncodeError:
+                # Convert files when text is added that can't be written in their encoding
+                open ('debug.log', 'a').write ('Converting {} from {} to UTF-8\n'.format (self.path, self.encoding))
+                self.encoding = 'utf-8'
+                lines_hash = ui.get_lines_hash (lines, self.encoding, self.newline)
+            if lines_hash != self.saved_hash:
+                ui.write_lines (self.path, lines, self.encoding, self.newline)
+                self.saved_hash = lines_hash
+            self.saved_version = version
+            return (version, lines_hash)
+
+    # Called once for each group of changes to the file
+    def _file_changed (self, change):
         loop = asyncio.get_event_loop ()
         if self.save_handle is not None:
             self.save_handle.cancel ()
-        self.save_handle = loop.call_later (1.0, self._save_file)
+        self.save_handle = loop.call_later (self._get_autosave_delay (), self._save_file)
+
+    def _get_autosave_delay (self):
+        if self.journal is None:
+            return _UNJOURNALED_AUTOSAVE_DELAY
+        return _AUTOSAVE_DELAY
 
     def _save_file (self):
         self.save_handle = None
-        self.save ()
+        # Try again when the file is loaded
+        if self.load_handle is not None:
+            self.save_handle = asyncio.get_event_loop ().call_later (self._get_autosave_delay (), self._save_file)
+            return
+        version = self.buffer.version
+        if version == self.saved_version:
+            return
+        # Write a copy of the lines in another thread so editing can continue
+        future = asyncio.get_event_loop ().run_in_executor (None, self._write_lines, version, self.buffer.lines.copy ())
+        future.add_done_callback (self._save_done)
+
+    def _save_done (self, future):
+        if future.exception () is not None:
+            open ('debug.log', 'a').write ('Failed to save {}: {}\n'.format (self.path, future.exception ()))
+        elif future.result () is not None:
+            self._saved (*future.result ())
+
+    def _get_cursor_offset (self):
+        (y, x) = self.view.cursor
+        if y >= len (self.buffer.lines):
+            return (y, 0)
+        return (y, self.buffer.get_offset (y, x))
+
+    def _select_match (self, match):
+        if match is None:
+            return
+        (y, offset) = match
+        self.view.set_cursor (y, self.buffer.get_column (y, offset))
 
-    def render (self, frame, theme):
-        # FIXME: Do this not every frame but only when the view changes
+    # Show matches of query and move to the first one from the cursor
+    def find (self, query):
+        self.search.set_query (query)
+        self.view.invalidate ()
+        (y, offset) = self._get_cursor_offset ()
+        self._select_match (self.search.find_next (y, offset - 1))
+
+    def find_next (self):
+        self._select_match (self.search.find_next (*self._get_cursor_offset ()))
+
+    def find_previous (self):
+        self._select_match (self.search.find_previous (*self._get_cursor_offset ()))
+
+    def replace_all (self, text):
+        self.search.replace_all (text)
+
+    def _view_scrolled (self, start_line, height):
         # FIXME: Hide scrollbar when less than one page
         n_lines = len (self.buffer.lines)
         if n_lines > 0:
-            start = self.view.start_line / n_lines
-            end = (self.view.start_line + frame.height) / n_lines
+            start = start_line / n_lines
+            end = (start_line + height) / n_lines
         else:
             start = 0
-            end = frame.height
+            end = height
         self.scroll.set_position (start, end)
-        ui.Grid.render (self, frame, theme)
 
 class Editor (ui.Grid):
     def __init__ (self):
@@ -211,7 +447,11 @@ class Editor (ui.Grid):
         (_, file_view) = self._find_file (path)
         if file_view is not None:
             return
-        file_view = FileView (path)
+        try:
+            file_view = FileView (path)
+        except (OSError, UnicodeError):
+            # Failed to read, already logged
+            return
         self.file_stack.add_child (file_view)
         self.file_views.append (file_view)
         self.tabs.add_child (path)
@@ -237,15 +477,18 @@ class Editor (ui.Grid):
     def save_file (self):
         self.file_views[self.selected].save ()
 
+    def get_file_view (self):
+        return self.file_views[self.selected]
+
     def get_path (self):
         return self.file_views[self.selected].path
 
 class PythonConsole (ui.Grid):
-    def __init__ (self, changed_callback = None):
+    def __init__ (self):
         ui.Grid.__init__ (self)
         console_bar = ui.Bar (unicodedata.lookup ('SNAKE') + ' Python')
         self.append_row (console_bar)
-        self.console = ui.Console (changed_callback = changed_callback)
+        self.console = ui.Console ()
         self.append_row (self.console)
         self.focus (self.console)
 
@@ -256,25 +499,25 @@ class PythonConsole (ui.Grid):
             self.console.run (['python3', program])
 
 class PrideDisplay (ui.Display):
-    def __init__ (self, app, screen):
-        ui.Display.__init__ (self, screen)
+    def __init__ (self, app, screen, output = None):
+        ui.Display.__init__ (self, screen, output)
         self.app = app
 
     def handle_event (self, event):
         open ('debug.log', 'a').write ('EVENT {}\n'.format (event))
         if isinstance (event, ui.KeyInputEvent):
             if event.key == ui.Key.F1:
-                self.app.help_dialog.visible = not self.app.help_dialog.visible
+                self.app.help_dialog.set_visible (not self.app.help_dialog.visible)
                 if self.app.help_dialog.visible:
                     self.app.stack.raise_child (self.app.help_dialog)
                 return True
             elif event.key == ui.Key.F2:
-                self.app.menu_dialog.visible = not self.app.menu_dialog.visible
+                self.app.menu_dialog.set_visible (not self.app.menu_dialog.visible)
                 if self.app.menu_dialog.visible:
                     self.app.stack.raise_child (self.app.menu_dialog)
                 return True
             elif event.key == ui.Key.CTRL_O:
-                self.app.file_dialog.visible = not self.app.file_dialog.visible
+                self.app.file_dialog.set_visible (not self.app.file_dialog.visible)
                 if self.app.file_dialog.visible:
                     self.app.stack.raise_child (self.app.file_dialog)
                 return True
@@ -299,16 +542,24 @@ class PrideDisplay (ui.Display):
                 self.app.fullscreen = not self.app.fullscreen
                 self.app.update_visibility ()
                 return True
+            elif event.key == ui.Key.CTRL_F:
+                self.app.search_dialog.set_visible (not self.app.search_dialog.visible)
+                if self.app.search_dialog.visible:
+                    self.app.stack.raise_child (self.app.search_dialog)
+                return True
+            elif event.key == ui.Key.CTRL_G:
+                self.app.editor.get_file_view ().find_next ()
+                return True
             elif event.key == ui.Key.INSERT:
-                self.app.emoji_dialog.visible = not self.app.emoji_dialog.visible
+                self.app.emoji_dialog.set_visible (not self.app.emoji_dialog.visible)
                 self.app.stack.raise_child (self.app.emoji_dialog)
                 return True
 
         return self.app.stack.handle_event (event)
 
 class Pride:
-    def __init__ (self, screen):
-        self.display = PrideDisplay (self, screen)
+    def __init__ (self, screen, output = None):
+        self.display = PrideDisplay (self, screen, output)
         self.fullscreen = False
 
         self.stack = ui.Stack ()
@@ -322,45 +573,49 @@ class Pride:
         self.editor.load_file ('README.md')
         self.main_list.append_row (self.editor)
 
-        def console_changed ():
-            self.display.refresh ()
-        self.python_console = PythonConsole (console_changed)
+        self.python_console = PythonConsole ()
         self.main_list.append_row (self.python_console)
 
         self.main_list.focus (self.editor)
 
         self.help_dialog = HelpDialog ()
-        self.help_dialog.visible = False
+        self.help_dialog.set_visible (False)
         self.stack.add_child (self.help_dialog)
 
         self.menu_dialog = MenuDialog ()
-        self.menu_dialog.visible = False
+        self.menu_dialog.set_visible (False)
         self.menu_dialog.set_scale (0.5, 0.5)
         self.stack.add_child (self.menu_dialog)
 
         self.file_dialog = FileDialog (self._on_file_selected)
-        self.file_dialog.visible = False
+        self.file_dialog.set_visible (False)
         self.file_dialog.set_scale (0.5, 0.5)
         self.stack.add_child (self.file_dialog)
 
+        self.search_dialog = SearchDialog (self.editor)
+        self.search_dialog.set_visible (False)
+        self.search_dialog.set_scale (0.5, 0.0)
+        self.search_dialog.set_align (0.5, 0.0)
+        self.stack.add_child (self.search_dialog)
+
         self.emoji_dialog = ui.EmojiDialog ()
-        self.emoji_dialog.visible = False
+        self.emoji_dialog.set_visible (False)
         self.emoji_dialog.select_character = self.select_emoji
         self.emoji_dialog.set_scale (0.5, 0.5)
         self.stack.add_child (self.emoji_dialog)
 
     def _on_file_selected (self, path):
-        self.file_dialog.visible = False
+        self.file_dialog.set_visible (False)
         self.editor.load_file (path)
         self.editor.select_file (path)
 
     def select_emoji (self, character):
         self.editor.insert (character)
-        self.emoji_dialog.visible = False
+        self.emoji_dialog.set_visible (False)
 
     def run (self):
         self.python_console.run ()
-        self.display.refresh ()
+        self.display.invalidate ()
 
         loop = asyncio.get_event_loop ()
         try:
@@ -374,5 +629,5 @@ class Pride:
 
     def update_visibility (self):
         focus_child = self.main_list.focus_child
-        self.editor.visible = not self.fullscreen or focus_child is self.editor
-        self.python_console.visible = not self.fullscreen or focus_child is self.python_console
+        self.editor.set_visible (not self.fullscreen or focus_child is self.editor)
+        self.python_console.set_visible (not self.fullscreen or focus_child is self.python_console)
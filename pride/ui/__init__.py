@@ -1,24 +1,39 @@
+from .ansioutput import AnsiOutput
 from .bar import Bar
 from .box import Box
 from .box import BoxStyle
 from .button import Button
+from .colorallocator import ColorAllocator
 from .console import Console
 from .container import Container
+from .cursesoutput import CursesOutput
 from .display import Display
 from .emojidialog import EmojiDialog
 from .frame import Frame
 from .characterinputevent import CharacterInputEvent
+from .journal import Journal
 from .keyinputevent import Key
 from .keyinputevent import KeyInputEvent
 from .filemodel import FileModel
 from .focusevent import FocusEvent
 from .grid import Grid
 from .label import Label
+from .linerope import LineRope
 from .listmodel import ListModel
+from .mappedlines import MappedLines
+from .output import Output
+from .pythonhighlighter import PythonHighlighter
 from .scroll import Scroll
+from .searchindex import SearchIndex
 from .stack import Stack
 from .tabs import Tabs
 from .textbuffer import TextBuffer
+from .textchange import ChangeKind
+from .textchange import TextChange
+from .textfile import detect_format
+from .textfile import get_lines_hash
+from .textfile import read_lines
+from .textfile import write_lines
 from .textview import TextView
 from .theme import Theme
 from .treemodel import TreeModel
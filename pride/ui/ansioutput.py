@@ -0,0 +1,118 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import sys
+
+from .frame import BOLD, UNDERLINE, REVERSE
+from .output import Output
+
+# SGR codes to turn each attribute on and off
+_ATTRIBUTE_CODES = [ (BOLD, '1', '22'), (UNDERLINE, '4', '24'), (REVERSE, '7', '27') ]
+
+# Writes ANSI escape sequences with truecolor directly to the terminal.
+# Curses is still used to set up the terminal and read input.
+class AnsiOutput (Output):
+    def __init__ (self, screen, stream = None):
+        Output.__init__ (self)
+        self.screen = screen
+        if stream is None:
+            stream = sys.stdout.buffer
+        self.stream = stream
+        self._data = []
+        self._position = None
+        self._colors = (None, None)
+        self._attributes = 0
+        self._cursor_visible = None
+        self._color_codes = {}
+
+        # Let curses do its initial clear now, and stop it moving the cursor when reading input
+        self.screen.leaveok (True)
+        self.screen.refresh ()
+
+    def get_size (self):
+        (height, width) = self.screen.getmaxyx ()
+        return (width, height)
+
+    def clear (self):
+        Output.clear (self)
+        # Reset attributes and clear the screen, as we don't know what is on it
+        self._data.append ('\033[0m\033[2J')
+        self._position = None
+        self._colors = (None, None)
+        self._attributes = 0
+
+    def _get_color_code (self, color):
+        code = self._color_codes.get (color)
+        if code is None:
+            # FIXME: Validate color
+            code = '2;{};{};{}'.format (int (color[1:3], 16), int (color[3:5], 16), int (color[5:], 16))
+            self._color_codes[color] = code
+        return code
+
+    def _move (self, x, y):
+        if self._position == (x, y):
+            return
+        if self._position is not None and self._position[1] == y:
+            if x > self._position[0]:
+                self._data.append ('\033[{}C'.format (x - self._position[0]))
+            else:
+                self._data.append ('\033[{}D'.format (self._position[0] - x))
+        elif x == 0 and self._position is not None and self._position[1] + 1 == y:
+            self._data.append ('\r\n')
+        else:
+            self._data.append ('\033[{};{}H'.format (y + 1, x + 1))
+        self._position = (x, y)
+
+    def draw_text (self, x, y, text, width, foreground, background, attributes = 0):
+        if foreground is None:
+            foreground = '#FFFFFF'
+        if background is None:
+            background = '#000000'
+
+        self._move (x, y)
+
+        # Only change the colors and attributes that are different
+        codes = []
+        for (flag, on_code, off_code) in _ATTRIBUTE_CODES:
+            if attributes & flag != self._attributes & flag:
+                codes.append (on_code if attributes & flag else off_code)
+        self._attributes = attributes
+        if foreground != self._colors[0]:
+            codes.append ('38;' + self._get_color_code (foreground))
+        if background != self._colors[1]:
+            codes.append ('48;' + self._get_color_code (background))
+        if len (codes) > 0:
+            self._data.append ('\033[' + ';'.join (codes) + 'm')
+        self._colors = (foreground, background)
+
+        self._data.append (text)
+
+        # Cursor position is uncertain after writing into the last column
+        (screen_width, _) = self.get_size ()
+        if x + width >= screen_width:
+            self._position = None
+        else:
+            self._position = (x + width, y)
+
+    def set_cursor (self, cursor):
+        if cursor is None:
+            if self._cursor_visible is not False:
+                self._data.append ('\033[?25l')
+                self._cursor_visible = False
+        else:
+            self._move (cursor[0], cursor[1])
+            if self._cursor_visible is not True:
+                self._data.append ('\033[?25h')
+                self._cursor_visible = True
+
+    def flush (self):
+        data = ''.join (self._data).encode ('utf-8')
+        self._data = []
+        self.stream.write (data)
+        self.stream.flush ()
+        return len (data)
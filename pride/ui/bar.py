@@ -12,10 +12,12 @@ class Bar (Widget):
     def __init__ (self, title = ''):
         Widget.__init__ (self)
         self.title = title
+        self.opaque = True
         self.set_scale (1.0, 0.0)
 
-    def set_title (self, text):
+    def set_title (self, title):
         self.title = title
+        self.invalidate_size ()
 
     def get_size (self):
         return (len (self.title), 1)
@@ -6,7 +6,6 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
-from .frame import Frame
 from .container import Container
 
 class BoxStyle:
@@ -23,19 +22,25 @@ class Box (Container):
         self.style = style
         self.foreground = foreground
         self.background = background
+        self.opaque = True
 
     def set_child (self, child):
         self.child = child
+        child.parent = self
         self.focus (child)
+        self.invalidate_size ()
 
     def set_style (self, style):
         self.style = style
+        self.invalidate ()
 
     def set_foreground (self, foreground):
         self.foreground = foreground
+        self.invalidate ()
 
     def set_background (self, background):
         self.background = background
+        self.invalidate ()
 
     def get_size (self):
         if self.child is not None and self.child.visible:
@@ -44,19 +49,27 @@ class Box (Container):
             (width, height) = (0, 0)
         return (width + 4, height + 2)
 
+    def render_children (self, frame, theme, force = False):
+        if self.child is not None and self.child.visible:
+            self.render_child (self.child, frame, 2, 1, frame.width - 4, frame.height - 2, theme, force)
+
+    def _get_background (self, theme):
+        if self.background is None:
+            return theme.box_background
+        else:
+            return self.background
+
+    def render_background (self, frame, theme):
+        frame.clear (self._get_background (theme))
+
     def render (self, frame, theme):
         if self.foreground is None:
             foreground = theme.box_border
         else:
             foreground = self.foreground
-        if self.background is None:
-            background = theme.box_background
-        else:
-            background = self.background
+        background = self._get_background (theme)
         frame.clear (background)
-        if self.child is not None and self.child.visible:
-            child_frame = self.render_child (self.child, frame.width - 4, frame.height - 2, theme)
-            frame.composite (2, 1, child_frame)
+        self.render_children (frame, theme, True)
         if self.style == BoxStyle.SQUARE:
             top_left = '┌'
             top_right = '┐'
@@ -0,0 +1,140 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import collections
+import curses
+
+# The standard sixteen terminal colors (as used by xterm)
+_ANSI_COLORS = [ (0x00, 0x00, 0x00), (0xCD, 0x00, 0x00), (0x00, 0xCD, 0x00), (0xCD, 0xCD, 0x00),
+                 (0x00, 0x00, 0xEE), (0xCD, 0x00, 0xCD), (0x00, 0xCD, 0xCD), (0xE5, 0xE5, 0xE5),
+                 (0x7F, 0x7F, 0x7F), (0xFF, 0x00, 0x00), (0x00, 0xFF, 0x00), (0xFF, 0xFF, 0x00),
+                 (0x5C, 0x5C, 0xFF), (0xFF, 0x00, 0xFF), (0x00, 0xFF, 0xFF), (0xFF, 0xFF, 0xFF) ]
+
+# Levels used in the 6x6x6 color cube of 256 color terminals
+_CUBE_LEVELS = [ 0x00, 0x5F, 0x87, 0xAF, 0xD7, 0xFF ]
+
+def _get_distance (a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+def _get_nearest (color, palette):
+    nearest = 0
+    nearest_distance = None
+    for (i, c) in enumerate (palette):
+        distance = _get_distance (color, c)
+        if nearest_distance is None or distance < nearest_distance:
+            nearest = i
+            nearest_distance = distance
+    return nearest
+
+# Nearest color cube level for each channel value
+_CUBE_LOOKUP = [ _get_nearest ((value, 0, 0), [(level, 0, 0) for level in _CUBE_LEVELS]) for value in range (256) ]
+
+def _get_nearest_256 (color):
+    # Match against the color cube, greyscale ramp and standard colors separately
+    # as checking all 256 colors is too slow.
+    levels = (_CUBE_LOOKUP[color[0]], _CUBE_LOOKUP[color[1]], _CUBE_LOOKUP[color[2]])
+    cube_index = 16 + levels[0] * 36 + levels[1] * 6 + levels[2]
+    cube_color = (_CUBE_LEVELS[levels[0]], _CUBE_LEVELS[levels[1]], _CUBE_LEVELS[levels[2]])
+
+    grey = min (max ((sum (color) // 3 - 8 + 5) // 10, 0), 23)
+    grey_index = 232 + grey
+    grey_color = (8 + grey * 10,) * 3
+
+    ansi_index = _get_nearest (color, _ANSI_COLORS)
+    candidates = [ (_get_distance (color, _ANSI_COLORS[ansi_index]), ansi_index),
+                   (_get_distance (color, cube_color), cube_index),
+                   (_get_distance (color, grey_color), grey_index) ]
+    return min (candidates)[1]
+
+def _parse_color (color):
+    # FIXME: Validate color
+    return (int (color[1:3], 16), int (color[3:5], 16), int (color[5:], 16))
+
+class ColorAllocator:
+    def __init__ (self):
+        self.has_colors = curses.has_colors ()
+        if self.has_colors:
+            self.n_colors = curses.COLORS
+            self.n_pairs = curses.COLOR_PAIRS
+        else:
+            self.n_colors = 0
+            self.n_pairs = 0
+
+        # Pair 0 is fixed to the terminal defaults
+        self.max_pairs = max (self.n_pairs - 1, 0)
+
+        # If the terminal supports it, define colors exactly leaving the standard colors alone
+        self.exact_colors = self.has_colors and self.n_colors > 16 and curses.can_change_color ()
+        self._next_exact_color = 16
+
+        # Lookup table from colors quantised to four bits per channel to the nearest palette entry
+        self._lookup = []
+        if self.n_colors >= 256 and not self.exact_colors:
+            get_nearest = _get_nearest_256
+        else:
+            palette = _ANSI_COLORS[:min (self.n_colors, 16)]
+            get_nearest = lambda color: _get_nearest (color, palette)
+        if self.n_colors > 0:
+            for r in range (16):
+                for g in range (16):
+                    for b in range (16):
+                        self._lookup.append (get_nearest ((r * 17, g * 17, b * 17)))
+
+        self._colors = {}
+        self._pairs = collections.OrderedDict ()
+
+        # Number of cells on the screen drawn with each pair, pairs in use are only replaced when all of them are
+        self.pair_cells = collections.Counter ()
+
+        # Pairs that have been replaced since this was last cleared.
+        # Any cells on the screen drawn with these pairs will have changed color.
+        self.evicted = []
+
+    def get_color (self, color):
+        i = self._colors.get (color)
+        if i is not None:
+            return i
+
+        rgb = _parse_color (color)
+        if self.exact_colors and self._next_exact_color < self.n_colors:
+            i = self._next_exact_color
+            self._next_exact_color += 1
+            curses.init_color (i, 1000 * rgb[0] // 255, 1000 * rgb[1] // 255, 1000 * rgb[2] // 255)
+        else:
+            i = self._lookup[(rgb[0] >> 4) << 8 | (rgb[1] >> 4) << 4 | rgb[2] >> 4]
+        self._colors[color] = i
+        return i
+
+    def get_pair (self, foreground, background):
+        if self.max_pairs == 0:
+            return 0
+        if foreground is None:
+            foreground = '#FFFFFF'
+        if background is None:
+            background = '#000000'
+
+        # Colors that map to the same palette entries share a pair
+        key = (self.get_color (foreground), self.get_color (background))
+        i = self._pairs.get (key)
+        if i is not None:
+            self._pairs.move_to_end (key)
+            return i
+
+        # Reuse the least recently used pair not on the screen when we run out
+        if len (self._pairs) < self.max_pairs:
+            i = len (self._pairs) + 1
+        else:
+            unused_key = next ((k for (k, j) in self._pairs.items () if self.pair_cells[j] <= 0), None)
+            if unused_key is None:
+                (evicted_key, i) = self._pairs.popitem (last = False)
+                self.evicted.append (evicted_key)
+            else:
+                i = self._pairs.pop (unused_key)
+        curses.init_pair (i, key[0], key[1])
+        self._pairs[key] = i
+        return i
@@ -7,22 +7,60 @@
 # license.
 
 import asyncio
+import fcntl
 import os
 import pty
 import signal
+import struct
 import subprocess
+import termios
 
+from .frame import BOLD
+from .frame import REVERSE
+from .frame import UNDERLINE
 from .keyinputevent import Key
-from .textbuffer import TextBuffer
+from .terminalscreen import DEFAULT_STYLE
+from .terminalscreen import TerminalScreen
+from .vtparser import VTParser
 from .widget import Widget
 
+# Get parameter i of a control sequence, which is default if not given
+def _get_param (params, i, default):
+    if i < len (params) and params[i] != 0:
+        return params[i]
+    return default
+
+# Colors for the 16 standard color codes, the same as xterm
+_PALETTE = [ '#000000', '#CD0000', '#00CD00', '#CDCD00', '#0000EE', '#CD00CD', '#00CDCD', '#E5E5E5',
+             '#7F7F7F', '#FF0000', '#00FF00', '#FFFF00', '#5C5CFF', '#FF00FF', '#00FFFF', '#FFFFFF' ]
+
+# Levels of each component in the 6x6x6 color cube
+_CUBE_LEVELS = [ 0x00, 0x5F, 0x87, 0xAF, 0xD7, 0xFF ]
+
+def _get_rgb_color (r, g, b):
+    return '#{:02X}{:02X}{:02X}'.format (min (r, 255), min (g, 255), min (b, 255))
+
+# Get color n of the 256 color palette
+def _get_palette_color (n):
+    if n < 16:
+        return _PALETTE[n]
+    elif n < 232:
+        n -= 16
+        return _get_rgb_color (_CUBE_LEVELS[n // 36], _CUBE_LEVELS[n // 6 % 6], _CUBE_LEVELS[n % 6])
+    else:
+        level = 8 + (min (n, 255) - 232) * 10
+        return _get_rgb_color (level, level, level)
+
 class Console (Widget):
-    def __init__ (self, changed_callback = None):
+    def __init__ (self):
         Widget.__init__ (self)
         self.pid = 0
         self.fd = -1
-        self.cursor = (0, 0)
-        self.buffer = TextBuffer (changed_callback = changed_callback)
+        self.screen = TerminalScreen ()
+        # Number of lines the view is scrolled back into the scrollback
+        self.scroll_offset = 0
+        self.parser = self._make_parser ()
+        self.opaque = True
         self.set_scale (1.0, 1.0)
 
     def get_size (self):
@@ -30,7 +68,10 @@ class Console (Widget):
 
     def handle_input (self):
         if not self.read ():
-            pass
+            return
+        # Show new output
+        self.scroll_offset = 0
+        self.invalidate ()
         # FIXME
         #asyncio.get_event_loop ().remove_reader (self.fd)
         #self.console.run (['python3', '-q'])
@@ -40,213 +81,121 @@ class Console (Widget):
         if self.pid != 0:
             asyncio.get_event_loop ().remove_reader (self.fd)
 
-        self.read_buffer = bytes ()
-        last_line = 0
-        for (i, line) in enumerate (self.buffer.lines):
-            if line != '':
-                last_line = i
-        self.cursor = (0, last_line)
+        # Start on a new line after the output from the last program
+        self.parser = self._make_parser ()
+        self.screen.style = DEFAULT_STYLE
+        self.scroll_offset = 0
+        self.screen.set_alternate_screen (False)
+        self.screen.set_scroll_region (0)
+        (x, y) = self.screen.cursor
+        self.screen.set_cursor (0, y)
+        if x != 0:
+            self.screen.line_feed ()
+        self.invalidate ()
         if self.pid != 0:
             os.kill (self.pid, signal.SIGTERM)
         (self.pid, self.fd) = pty.fork ()
         if self.pid == 0:
             subprocess.run (args)
             exit ()
+        self._set_window_size ()
         asyncio.get_event_loop ().add_reader (self.fd, self.handle_input)
 
+    # Tell the program how big the screen is
+    def _set_window_size (self):
+        if self.fd < 0:
+            return
+        try:
+            fcntl.ioctl (self.fd, termios.TIOCSWINSZ, struct.pack ('HHHH', self.screen.height, self.screen.width, 0, 0))
+        except OSError:
+            pass
+
     def read (self):
         try:
-            self.read_buffer += os.read (self.fd, 65535)
+            data = os.read (self.fd, 65535)
         except:
             os.close (self.fd) # FIXME: Should unregister fd
             return False
 
-        #open ('debug.log', 'a').write ('processing {}\n'.format (repr (self.read_buffer)))
-
-        # Process data
-        while len (self.read_buffer) > 0:
-            c = self.read_buffer[0]
-            #open ('debug.log', 'a').write ('Character {}\n'.format (c))
-            def is_utf8_continuation (c):
-                return c & 0xC0 == 0x80
-            if c == 0x1B: # ESC
-                if len (self.read_buffer) == 1:
-                    return True
-                # ANSI CSI
-                if self.read_buffer[1] == ord ('['):
-                    # Find end characters
-                    end = 2
-                    def is_csi_end (c):
-                        return c >= 0x40 and c <= 0x7F;
-                    while end < len (self.read_buffer) and not is_csi_end (self.read_buffer[end]):
-                        end += 1
-                    if end >= len (self.read_buffer):
-                        return True # Not got full sequence, wait for more data
-
-                    code = chr (self.read_buffer[end])
-                    params = self.read_buffer[2:end].decode ('ascii')
-                    #open ('debug.log', 'a').write ('console CSI code={} params={}\n'.format (code, params))
-                    self.read_buffer = self.read_buffer[end + 1:]
-                    if code == 'A': # CUU - cursor up
-                        count = 1
-                        if params != '':
-                            count = int (param)
-                        self.up (count)
-                    elif code == 'B': # CUD - cursor down
-                        count = 1
-                        if params != '':
-                            count = int (param)
-                        self.down (count)
-                    elif code == 'C': # CUF - cursor right
-                        count = 1
-                        if params != '':
-                            count = int (param)
-                        self.right (count)
-                    elif code == 'D': # CUB - cursor left
-                        count = 1
-                        if params != '':
-                            count = int (param)
-                        self.left (count)
-                    elif code == 'H': # CUP - cursor position
-                        line = 1
-                        col = 1
-                        if params != '':
-                            args = params.split (';')
-                            if len (args) > 0:
-                                line = int (args[0])
-                            if len (args) > 1:
-                                col = int (args[1])
-                        self.cursor = (col - 1, line - 1)
-                    elif code == 'J': # ED - erase display
-                        mode = params
-                        if mode == '' or mode == '0': # Erase cursor to end of display
-                            open ('debug.log', 'a').write ('Unknown ED mode={}\n'.format (params))
-                        elif mode == '1': # Erase from start to cursor (inclusive)
-                            open ('debug.log', 'a').write ('Unknown ED mode={}\n'.format (params))
-                        elif mode == '2': # Erase whole display
-                            self.buffer.clear ()
-                        else:
-                            open ('debug.log', 'a').write ('Unknown ED mode={}\n'.format (params))
-                    elif code == 'K': # EL - erase line
-                        mode = params
-                        if mode == '' or mode == '0': # Delete cursor to end of line
-                            self.buffer.overwrite (self.cursor[0], self.cursor[1], ' ' * (80 - self.cursor[0])) # FIXME: end of line...
-                        elif mode == '1': # Delete from cursor to beginning of line
-                            self.buffer.overwrite (0, self.cursor[1], ' ' * self.cursor[0])
-                        elif mode == '2': # Clear entire line
-                            self.buffer.overwrite (0, self.cursor[1], ' ' * 80) # FIXME: end of line...
-                        else:
-                            open ('debug.log', 'a').write ('Unknown EL mode={}\n'.format (params))
-                    elif code == 'P': # DCH - delete characters
-                        count = 1
-                        if params != '':
-                            count = int (params)
-                        for i in range (count):
-                            self.buffer.delete_right (self.cursor[0], self.cursor[1])
-                    #elif code == 'X': # ECH - erase characters
-                    else:
-                        open ('debug.log', 'a').write ('Unknown CSI code={} params={}\n'.format (code, params))
-                # ANSI OSC (Operating System Command)
-                elif self.read_buffer[1] == ord (']'):
-                    end = 2
-                    def is_osc_end (c):
-                        return c <= 0x1F
-                    while end < len (self.read_buffer) and not is_osc_end (self.read_buffer[end]):
-                        end += 1
-                    if end >= len (self.read_buffer):
-                        return True # Not got full sequence, wait for more data
-
-                    code = chr (self.read_buffer[end])
-                    #open ('debug.log', 'a').write ('console OSC code={}\n'.format (code))
-                    self.read_buffer = self.read_buffer[end + 1:]
-
-                    open ('debug.log', 'a').write ('Unknown OSC code={}\n'.format (code))
-                else:
-                    # FIXME
-                    open ('debug.log', 'a').write ('Unknown escape code {}\n'.format (self.read_buffer[1]))
-                    self.read_buffer = self.read_buffer[1:]
-            elif c == 0x07: # BEL
-                # FIXME: Flash bell symbol or similar?
-                self.read_buffer = self.read_buffer[1:]
-            elif c == 0x08: # BS
-                self.left (1)
-                self.read_buffer = self.read_buffer[1:]
-            elif c == 0x0A: # LF
-                self.cursor = (0, self.cursor[1] + 1)
-                self.read_buffer = self.read_buffer[1:]
-            elif c == 0x0D: # CR
-                self.cursor = (0, self.cursor[1])
-                self.read_buffer = self.read_buffer[1:]
-            elif c >= 0x20 and c <= 0x7E: # UTF-8 one byte / ASCII
-                self.insert (c)
-                self.read_buffer = self.read_buffer[1:]
-            elif c & 0xE0 == 0xC0: # UTF-8 two byte
-                if len (self.read_buffer) < 2:
-                    return True
-                if not is_utf8_continuation (self.read_buffer[1]):
-                    open ('debug.log', 'a').write ('Invalid UTF-8 sequence {}\n'.format (c))
-                    self.read_buffer = self.read_buffer[1:]
-                    return True
-                character = (c & 0x1F) << 6 | self.read_buffer[1] & 0x3F
-                self.insert (character)
-                self.read_buffer = self.read_buffer[2:]
-            elif c & 0xF0 == 0xE0: # UTF-8 three byte
-                if len (self.read_buffer) < 3:
-                    return True
-                if not (is_utf8_continuation (self.read_buffer[1]) and is_utf8_continuation (self.read_buffer[2])):
-                    open ('debug.log', 'a').write ('Invalid UTF-8 sequence {}\n'.format (c))
-                    self.read_buffer = self.read_buffer[1:]
-                    return True
-                character = (c & 0x0F) << 12 | (self.read_buffer[1] & 0x3F) << 6 | self.read_buffer[2] & 0x3F
-                self.insert (character)
-                self.read_buffer = self.read_buffer[3:]
-            elif c & 0xF8 == 0xF0: # UTF-8 four byte
-                if len (self.read_buffer) < 4:
-                    return True
-                if not (is_utf8_continuation (self.read_buffer[1]) and is_utf8_continuation (self.read_buffer[2]) and is_utf8_continuation (self.read_buffer[3])):
-                    open ('debug.log', 'a').write ('Invalid UTF-8 sequence {}\n'.format (c))
-                    self.read_buffer = self.read_buffer[1:]
-                    return True
-                character = (c & 0x07) << 18 | (self.read_buffer[1] & 0x3F) << 12 | (self.read_buffer[2] & 0x3F) << 6 | self.read_buffer[3] & 0x3F
-                self.insert (character)
-                self.read_buffer = self.read_buffer[4:]
-            else:
-                open ('debug.log', 'a').write ('Unknown character {}\n'.format (c))
-                self.read_buffer = self.read_buffer[1:]
+        #open ('debug.log', 'a').write ('processing {}\n'.format (repr (data)))
+        self.parser.feed (data)
 
         return True
 
-    def insert (self, c):
-        self.buffer.overwrite (self.cursor[0], self.cursor[1], chr (c))
-        self.cursor = (self.cursor[0] + 1, self.cursor[1])
+    def _make_parser (self):
+        return VTParser (self.screen.write, self._execute, self._esc_dispatch, self._csi_dispatch, self._osc_dispatch)
+
+    def _execute (self, code):
+        handler = _EXECUTE_HANDLERS.get (code)
+        if handler is None:
+            open ('debug.log', 'a').write ('Unknown character {}\n'.format (code))
+            return
+        handler (self.screen)
 
-    def left (self, count):
-        count = min (count, self.cursor[0])
-        self.cursor = (self.cursor[0] - count, self.cursor[1])
+    def _esc_dispatch (self, final, intermediates):
+        handler = _ESC_HANDLERS.get (intermediates + final)
+        if handler is None:
+            open ('debug.log', 'a').write ('Unknown escape code {}\n'.format (repr (intermediates + final)))
+            return
+        handler (self.screen)
 
-    def right (self, count):
-        #FIXME: count = min (count, width - cursor[0])
-        self.cursor = (self.cursor[0] + count, self.cursor[1])
+    def _csi_dispatch (self, final, params, intermediates):
+        #open ('debug.log', 'a').write ('console CSI code={} params={}\n'.format (final, params))
+        handler = _CSI_HANDLERS.get (intermediates + final)
+        if handler is None:
+            open ('debug.log', 'a').write ('Unknown CSI code={} params={}\n'.format (intermediates + final, params))
+            return
+        handler (self.screen, params)
 
-    def up (self, count):
-        count = min (count, self.cursor[1])
-        self.cursor = (self.cursor[0], self.cursor[1] - count)
+    def _osc_dispatch (self, text):
+        open ('debug.log', 'a').write ('Unknown OSC {}\n'.format (repr (text)))
 
-    def down (self, count):
-        #FIXME: count = min (count, height - cursor[1])
-        self.cursor = (self.cursor[0], self.cursor[1] + count)
+    # Move the view count lines back into the scrollback, or forwards if negative
+    def scroll (self, count):
+        scroll_offset = max (0, min (self.scroll_offset + count, len (self.screen.scrollback)))
+        if scroll_offset == self.scroll_offset:
+            return
+        self.scroll_offset = scroll_offset
+        self.invalidate ()
 
     def render (self, frame, theme):
+        if (frame.width, frame.height) != (self.screen.width, self.screen.height) and frame.width > 0 and frame.height > 0:
+            self.screen.resize (frame.width, frame.height)
+            self._set_window_size ()
         frame.clear (theme.console_background)
-        for (y, line) in enumerate (self.buffer.lines):
-            frame.render_text (0, y, line, theme.text_color)
-        frame.cursor = self.cursor
+
+        # Only the lines in view are drawn, starting scroll_offset lines back in the scrollback
+        scrollback = self.screen.scrollback
+        self.scroll_offset = min (self.scroll_offset, len (scrollback))
+        for y in range (self.screen.height):
+            line = y - self.scroll_offset
+            if line < 0:
+                spans = scrollback[len (scrollback) + line]
+            else:
+                spans = self.screen.get_spans (line)
+            for (x, text, (foreground, background, attributes)) in spans:
+                if foreground is None:
+                    foreground = theme.text_color
+                frame.render_text (x, y, text, foreground, background, attributes)
+
+        (x, y) = self.screen.cursor
+        if self.screen.cursor_visible and y + self.scroll_offset < self.screen.height:
+            frame.cursor = (x, y + self.scroll_offset)
+        else:
+            frame.cursor = None
 
     def handle_character_event (self, event):
+        self.scroll (-self.scroll_offset)
         os.write (self.fd, bytes (chr (event.character), 'utf-8'))
         return True
 
     def handle_key_event (self, event):
+        # Programs using the alternate screen have no scrollback and handle paging themselves
+        if event.key in (Key.PAGE_UP, Key.PAGE_DOWN) and self.screen.main_screen is None:
+            page = max (1, self.screen.height - 1)
+            self.scroll (page if event.key == Key.PAGE_UP else -page)
+            return True
+
         if event.key == Key.ENTER:
             os.write (self.fd, '\n'.encode ('ascii'))
         elif event.key == Key.TAB:
@@ -267,7 +216,215 @@ class Console (Widget):
             os.write (self.fd, '\033[H'.encode ('ascii'))
         elif event.key == Key.END:
             os.write (self.fd, '\033[F'.encode ('ascii'))
+        elif event.key == Key.PAGE_UP:
+            os.write (self.fd, '\033[5~'.encode ('ascii'))
+        elif event.key == Key.PAGE_DOWN:
+            os.write (self.fd, '\033[6~'.encode ('ascii'))
         else:
             return False
 
+        # Go back to the bottom to see what was typed
+        self.scroll (-self.scroll_offset)
         return True
+
+def _bell (screen):
+    # FIXME: Flash bell symbol or similar?
+    pass
+
+# CUU - cursor up
+def _cursor_up (screen, params):
+    (x, y) = screen.cursor
+    screen.set_cursor (x, y - _get_param (params, 0, 1))
+
+# CUD - cursor down
+def _cursor_down (screen, params):
+    (x, y) = screen.cursor
+    screen.set_cursor (x, y + _get_param (params, 0, 1))
+
+# CUF - cursor right
+def _cursor_right (screen, params):
+    (x, y) = screen.cursor
+    screen.set_cursor (x + _get_param (params, 0, 1), y)
+
+# CUB - cursor left
+def _cursor_left (screen, params):
+    (x, y) = screen.cursor
+    screen.set_cursor (x - _get_param (params, 0, 1), y)
+
+# CHA - cursor horizontal absolute
+def _cursor_column (screen, params):
+    screen.set_cursor (_get_param (params, 0, 1) - 1, screen.cursor[1])
+
+# VPA - vertical line position absolute
+def _cursor_line (screen, params):
+    screen.set_cursor (screen.cursor[0], _get_param (params, 0, 1) - 1)
+
+# CUP - cursor position
+def _cursor_position (screen, params):
+    screen.set_cursor (_get_param (params, 1, 1) - 1, _get_param (params, 0, 1) - 1)
+
+# ED - erase display
+def _erase_display (screen, params):
+    screen.erase_display (_get_param (params, 0, 0))
+
+# EL - erase line
+def _erase_line (screen, params):
+    screen.erase_line (_get_param (params, 0, 0))
+
+# ECH - erase characters
+def _erase_characters (screen, params):
+    screen.erase_characters (_get_param (params, 0, 1))
+
+# ICH - insert characters
+def _insert_characters (screen, params):
+    screen.insert_characters (_get_param (params, 0, 1))
+
+# DCH - delete characters
+def _delete_characters (screen, params):
+    screen.delete_characters (_get_param (params, 0, 1))
+
+# IL - insert lines
+def _insert_lines (screen, params):
+    screen.insert_lines (_get_param (params, 0, 1))
+
+# DL - delete lines
+def _delete_lines (screen, params):
+    screen.delete_lines (_get_param (params, 0, 1))
+
+# SU - scroll up
+def _scroll_up (screen, params):
+    screen.scroll_up (_get_param (params, 0, 1))
+
+# SD - scroll down
+def _scroll_down (screen, params):
+    screen.scroll_down (_get_param (params, 0, 1))
+
+# DECSTBM - set top and bottom margins
+def _set_scroll_region (screen, params):
+    screen.set_scroll_region (_get_param (params, 0, 1) - 1, _get_param (params, 1, screen.height) - 1)
+
+# SCOSC - save cursor
+def _save_cursor (screen, params):
+    screen.save_cursor ()
+
+# SCORC - restore cursor
+def _restore_cursor (screen, params):
+    screen.restore_cursor ()
+
+# Get a 256 color (5;n) or RGB (2;r;g;b) color from the parameters starting at i.
+# Returns (color, index of the next parameter), with color None if not valid.
+def _get_extended_color (params, i):
+    if i + 1 < len (params) and params[i] == 5:
+        return (_get_palette_color (params[i + 1]), i + 2)
+    elif i + 3 < len (params) and params[i] == 2:
+        return (_get_rgb_color (params[i + 1], params[i + 2], params[i + 3]), i + 4)
+    else:
+        return (None, len (params))
+
+# SGR - select graphic rendition
+def _select_graphic_rendition (screen, params):
+    if len (params) == 0:
+        params = [ 0 ]
+    (foreground, background, attributes) = screen.style
+    i = 0
+    while i < len (params):
+        code = params[i]
+        i += 1
+        if code == 0:
+            (foreground, background, attributes) = DEFAULT_STYLE
+        elif code == 1:
+            attributes |= BOLD
+        elif code == 4:
+            attributes |= UNDERLINE
+        elif code == 7:
+            attributes |= REVERSE
+        elif code == 22:
+            attributes &= ~BOLD
+        elif code == 24:
+            attributes &= ~UNDERLINE
+        elif code == 27:
+            attributes &= ~REVERSE
+        elif 30 <= code <= 37:
+            foreground = _PALETTE[code - 30]
+        elif code == 38:
+            (color, i) = _get_extended_color (params, i)
+            if color is not None:
+                foreground = color
+        elif code == 39:
+            foreground = None
+        elif 40 <= code <= 47:
+            background = _PALETTE[code - 40]
+        elif code == 48:
+            (color, i) = _get_extended_color (params, i)
+            if color is not None:
+                background = color
+        elif code == 49:
+            background = None
+        elif 90 <= code <= 97:
+            foreground = _PALETTE[code - 90 + 8]
+        elif 100 <= code <= 107:
+            background = _PALETTE[code - 100 + 8]
+        elif code in (2, 3, 5, 6, 8, 9, 23, 25, 28, 29):
+            pass # FIXME: Faint, italic, blink, hidden and strikethrough text
+        else:
+            open ('debug.log', 'a').write ('Unknown SGR code {}\n'.format (code))
+    screen.style = (foreground, background, attributes)
+
+def _set_private_modes (screen, params, enabled):
+    for mode in params:
+        if mode == 7: # Auto wrap
+            screen.autowrap = enabled
+        elif mode == 25: # Show cursor
+            screen.cursor_visible = enabled
+        elif mode in (47, 1047, 1049): # Alternate screen
+            if mode == 1049 and enabled:
+                screen.save_cursor ()
+            screen.set_alternate_screen (enabled)
+            if mode == 1049 and not enabled:
+                screen.restore_cursor ()
+        else:
+            open ('debug.log', 'a').write ('Unknown private mode {}\n'.format (mode))
+
+# DECSET - set private modes
+def _enable_private_modes (screen, params):
+    _set_private_modes (screen, params, True)
+
+# DECRST - reset private modes
+def _disable_private_modes (screen, params):
+    _set_private_modes (screen, params, False)
+
+# Functions to handle control characters and sequences
+_EXECUTE_HANDLERS = { 0x07: _bell,
+                      0x08: TerminalScreen.backspace,
+                      0x09: TerminalScreen.tab,
+                      0x0A: TerminalScreen.line_feed,
+                      0x0B: TerminalScreen.line_feed,
+                      0x0C: TerminalScreen.line_feed,
+                      0x0D: TerminalScreen.carriage_return }
+_ESC_HANDLERS = { '7': TerminalScreen.save_cursor,
+                  '8': TerminalScreen.restore_cursor,
+                  'D': TerminalScreen.line_feed,
+                  'M': TerminalScreen.reverse_line_feed }
+_CSI_HANDLERS = { '@': _insert_characters,
+                  'A': _cursor_up,
+                  'B': _cursor_down,
+                  'C': _cursor_right,
+                  'D': _cursor_left,
+                  'G': _cursor_column,
+                  'H': _cursor_position,
+                  'J': _erase_display,
+                  'K': _erase_line,
+                  'L': _insert_lines,
+                  'M': _delete_lines,
+                  'P': _delete_characters,
+                  'S': _scroll_up,
+                  'T': _scroll_down,
+                  'X': _erase_characters,
+                  'd': _cursor_line,
+                  'f': _cursor_position,
+                  'm': _select_graphic_rendition,
+                  'r': _set_scroll_region,
+                  's': _save_cursor,
+                  'u': _restore_cursor,
+                  '?h': _enable_private_modes,
+                  '?l': _disable_private_modes }
@@ -6,7 +6,6 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
-from .frame import Frame
 from .widget import Widget
 
 class Container (Widget):
@@ -14,6 +13,8 @@ class Container (Widget):
         Widget.__init__ (self)
         self._frames = {}
         self.focus_child = None
+        # Set if children are drawn over each other, so the cells under a child can't be drawn again
+        self.overlapping_children = False
 
     def focus (self, child):
         if self.focus_child is child:
@@ -23,14 +24,19 @@ class Container (Widget):
         self.focus_child = child
         if child is not None:
             child.set_focus (True)
+        self.invalidate ()
 
-    def render_child (self, child, width, height, theme):
-        frame = self._frames.get (child)
-        if frame is None or (frame.width, frame.height) != (width, height):
-            frame = Frame (width, height)
-            self._frames[child] = frame
-        child.render_aligned (frame, theme)
-        return frame
+    # Render a child into an area of frame, returns the frame the child was rendered into.
+    # Unless force is set the child is only rendered if it has changed.
+    def render_child (self, child, frame, x, y, width, height, theme, force = True):
+        key = (frame, x, y, width, height)
+        (child_key, child_frame) = self._frames.get (child, (None, None))
+        if child_key != key:
+            child_frame = frame.get_view (x, y, width, height)
+            self._frames[child] = (key, child_frame)
+            force = True
+        child.render_aligned (child_frame, theme, force)
+        return child_frame
 
     def handle_event (self, event):
         if self.focus_child is not None and self.focus_child.handle_event (event):
@@ -0,0 +1,80 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import array
+import curses
+
+from .colorallocator import ColorAllocator
+from .frame import BOLD, UNDERLINE, REVERSE
+from .output import Output
+
+_ATTRIBUTES = [ (BOLD, curses.A_BOLD), (UNDERLINE, curses.A_UNDERLINE), (REVERSE, curses.A_REVERSE) ]
+
+class CursesOutput (Output):
+    def __init__ (self, screen):
+        Output.__init__ (self)
+        self.screen = screen
+        self.color_allocator = ColorAllocator ()
+        # Pair used in each cell on the screen
+        self._width = 0
+        self._cell_pairs = array.array ('H')
+        # Set when everything is being drawn again
+        self._cleared = False
+        # We can't see what curses sends, so count the text it is given
+        self.counts_all_bytes = False
+        self._bytes_written = 0
+
+    def get_size (self):
+        (height, width) = self.screen.getmaxyx ()
+        return (width, height)
+
+    def clear (self):
+        Output.clear (self)
+        (self._width, height) = self.get_size ()
+        self._cell_pairs = array.array ('H', [ 0 ]) * (self._width * height)
+        self.color_allocator.pair_cells.clear ()
+        self.color_allocator.pair_cells[0] = len (self._cell_pairs)
+        self._cleared = True
+
+    def draw_text (self, x, y, text, width, foreground, background, attributes = 0):
+        # Release the pairs of the cells being drawn over so they can be reused
+        start = y * self._width + x
+        end = start + width
+        self.color_allocator.pair_cells.subtract (self._cell_pairs[start:end])
+        pair = self.color_allocator.get_pair (foreground, background)
+        self._cell_pairs[start:end] = array.array ('H', [ pair ]) * width
+        self.color_allocator.pair_cells[pair] += width
+
+        attr = curses.color_pair (pair)
+        for (flag, curses_attr) in _ATTRIBUTES:
+            if attributes & flag:
+                attr |= curses_attr
+        self.screen.addstr (y, x, text, attr)
+        self._bytes_written += len (text.encode ('utf-8'))
+
+    def set_cursor (self, cursor):
+        if cursor is None:
+            curses.curs_set (0)
+        else:
+            curses.curs_set (1)
+            self.screen.move (cursor[1], cursor[0])
+
+    def flush (self):
+        self.screen.refresh ()
+
+        # If we ran out of color pairs then cells already on the screen may have changed color.
+        # Drawing everything again won't help if that happened while drawing everything.
+        if len (self.color_allocator.evicted) > 0:
+            self.color_allocator.evicted = []
+            if not self._cleared:
+                self.invalid = True
+        self._cleared = False
+
+        bytes_written = self._bytes_written
+        self._bytes_written = 0
+        return bytes_written
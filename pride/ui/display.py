@@ -6,102 +6,248 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
+import array
 import asyncio
 import curses
 import sys
 
+from .cursesoutput import CursesOutput
+from .frame import COVERED
 from .frame import Frame
+from .frame import get_attributes
+from .frame import get_character
+from .frame import get_character_width
+from .frame import get_color
 from .container import Container
 from .keyinputevent import Key
 from .keyinputevent import KeyInputEvent
 from .characterinputevent import CharacterInputEvent
 from .theme import Theme
 
+# Value stored for cells where we don't know what is on the screen
+_UNKNOWN = 0xFFFFFFFF
+
 class Display (Container):
-    def __init__ (self, screen):
+    def __init__ (self, screen, output = None, max_fps = 30):
         Container.__init__ (self)
         self.screen = screen
+        if output is None:
+            output = CursesOutput (screen)
+        self.output = output
         self.child = None
         asyncio.get_event_loop ().add_reader (sys.stdin, self.handle_input)
         self.screen.nodelay (True)
         self.theme = Theme ()
+        self._frame = None
+        self._last_size = None
+        self._last_characters = None
+        self._last_foregrounds = None
+        self._last_backgrounds = None
+        self._last_attributes = None
+        self.max_fps = max_fps
+        self._refresh_handle = None
+        self._refresh_time = 0.0
+        self._last_refresh_time = None
+
+        # Number of cells and bytes written in the last refresh
+        self.cells_written = 0
+        self.bytes_written = 0
+        self.log_stats = False
 
     def set_child (self, child):
         self.child = child
+        child.parent = self
+        self.invalidate ()
+
+    def set_max_fps (self, max_fps):
+        self.max_fps = max_fps
+
+    # Request the display is completely refreshed. Multiple requests are merged into a
+    # single refresh, which occurs no more than max_fps times a second.
+    def invalidate (self):
+        self._dirty = True
+        self._schedule_refresh (False)
+
+    def invalidate_size (self):
+        self.invalidate ()
+
+    def render_background (self, frame, theme):
+        frame.reset ()
+
+    def _child_invalidated (self, child):
+        self._child_dirty = True
+        self._schedule_refresh (False)
+
+    def _schedule_refresh (self, immediate):
+        loop = asyncio.get_event_loop ()
+        time = loop.time ()
+        if immediate or self.max_fps is None or self.max_fps <= 0 or self._last_refresh_time is None:
+            refresh_time = time
+        else:
+            refresh_time = max (self._last_refresh_time + 1.0 / self.max_fps, time)
+
+        if self._refresh_handle is not None:
+            if self._refresh_time <= refresh_time:
+                return
+            self._refresh_handle.cancel ()
+
+        self._refresh_time = refresh_time
+        if refresh_time <= time:
+            self._refresh_handle = loop.call_soon (self._scheduled_refresh)
+        else:
+            self._refresh_handle = loop.call_at (refresh_time, self._scheduled_refresh)
+
+    def _scheduled_refresh (self):
+        self._refresh_handle = None
+        self.refresh ()
 
     def refresh (self):
-        (max_lines, max_width) = self.screen.getmaxyx ()
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel ()
+            self._refresh_handle = None
+        self._last_refresh_time = asyncio.get_event_loop ().time ()
+
+        # Only widgets that have changed are rendered, unless everything needs to be
+        (max_width, max_lines) = self.output.get_size ()
+        full = self._dirty
+        self._dirty = False
+        self._child_dirty = False
+        if self._frame is None or (self._frame.width, self._frame.height) != (max_width, max_lines):
+            self._frame = Frame (max_width, max_lines)
+            full = True
+        frame = self._frame
+        if full:
+            frame.reset ()
+        frame.cursor = None
         if self.child is not None:
-            frame = self.render_child (self.child, max_width, max_lines, self.theme)
+            child_frame = self.render_child (self.child, frame, 0, 0, max_width, max_lines, self.theme, full)
+            frame.cursor = child_frame.cursor
+
+        # Forget what is on the screen if it has changed size or been lost
+        if self._last_size != (max_width, max_lines) or self.output.invalid:
+            self._last_size = (max_width, max_lines)
+            self._last_characters = array.array ('I', [ _UNKNOWN ]) * (max_width * max_lines)
+            self._last_foregrounds = array.array ('I', [ _UNKNOWN ]) * (max_width * max_lines)
+            self._last_backgrounds = array.array ('I', [ _UNKNOWN ]) * (max_width * max_lines)
+            self._last_attributes = array.array ('I', [ _UNKNOWN ]) * (max_width * max_lines)
+            self.output.clear ()
+            full = True
+
+        # Only check the lines that have been drawn to
+        damage = frame.get_damage ()
+        if full:
+            lines = range (frame.height)
         else:
-            frame = Frame (max_width, max_lines)
-
-        # FIXME: Only if support colors, otherwise fallback to closest match
-        colors = {}
-        def get_color (color):
-            i = colors.get (color)
-            if i is None:
-                i = len (colors) + 1
-                # FIXME: Validate color
-                curses.init_color (i,
-                                   1000 * int (color[1:3], 16) // 255,
-                                   1000 * int (color[3:5], 16) // 255,
-                                   1000 * int (color[5:], 16) // 255)
-                colors[color] = i
-            return i
-
-        color_pairs = {}
-        def get_color_pair (foreground, background):
-            if foreground is None:
-                foreground = '#FFFFFF'
-            if background is None:
-                background = '#000000'
-            i = color_pairs.get ((foreground, background))
-            if i is None:
-                i = len (color_pairs) + 1
-                curses.init_pair (i, get_color (foreground), get_color (background))
-                color_pairs[(foreground, background)] = i
-            return i
-
-        for y in range (frame.height):
-            for x in range (frame.width):
-                pixel = frame.buffer[y][x]
-                get_color_pair (pixel.foreground, pixel.background)
-        for y in range (frame.height):
-            text = ''
-            current_color = (None, None)
+            lines = set ()
+            for (_, y, _, height) in damage:
+                lines.update (range (y, y + height))
+            lines = sorted (lines)
+        del damage[:]
+
+        # Draw changed cells, grouping adjacent cells with the same colors and attributes into a single span
+        characters = frame.characters
+        foregrounds = frame.foregrounds
+        backgrounds = frame.backgrounds
+        attributes = frame.attributes
+        last_characters = self._last_characters
+        last_foregrounds = self._last_foregrounds
+        last_backgrounds = self._last_backgrounds
+        last_attributes = self._last_attributes
+        cells_written = 0
+        for y in lines:
+            start = y * frame.width
+            end = start + frame.width
+
+            # Skip unchanged lines without looking at each cell
+            if characters[start:end] == last_characters[start:end] and \
+               foregrounds[start:end] == last_foregrounds[start:end] and \
+               backgrounds[start:end] == last_backgrounds[start:end] and \
+               attributes[start:end] == last_attributes[start:end]:
+                continue
+
+            span_x = 0
+            span_width = 0
+            span_text = ''
+            span_style = None
             x = 0
             while x < frame.width:
-                pixel = frame.buffer[y][x]
                 # FIXME: Can't place in bottom right for some reason
                 if y == frame.height - 1 and x == frame.width - 1:
                     break
-                if pixel.character is None:
-                    character = ' '
-                else:
-                    character = pixel.character
-                self.screen.addstr (y, x, character, curses.color_pair (get_color_pair (pixel.foreground, pixel.background)))
-                if pixel.is_wide ():
-                    x += 2
+                i = start + x
+                character = characters[i]
+                foreground = foregrounds[i]
+                background = backgrounds[i]
+                attribute = attributes[i]
+                if character == COVERED:
+                    # The wide character before it has been replaced
+                    width = 1
                 else:
-                    x += 1
+                    width = get_character_width (character)
+                # Only draw cells that have changed since the last refresh
+                if character != last_characters[i] or foreground != last_foregrounds[i] or background != last_backgrounds[i] or attribute != last_attributes[i]:
+                    last_characters[i] = character
+                    last_foregrounds[i] = foreground
+                    last_backgrounds[i] = background
+                    last_attributes[i] = attribute
+                    cell_style = (foreground, background, attribute)
+                    if span_text != '' and cell_style != span_style:
+                        self.output.draw_text (span_x, y, span_text, span_width, get_color (span_style[0]), get_color (span_style[1]), get_attributes (span_style[2]))
+                        span_text = ''
+                    if span_text == '':
+                        span_x = x
+                        span_width = 0
+                        span_style = cell_style
+                    if character == 0 or character == COVERED:
+                        span_text += ' '
+                    else:
+                        span_text += get_character (character)
+                    span_width += width
+                    cells_written += 1
+                elif span_text != '':
+                    self.output.draw_text (span_x, y, span_text, span_width, get_color (span_style[0]), get_color (span_style[1]), get_attributes (span_style[2]))
+                    span_text = ''
+                if width == 2 and x + 1 < frame.width:
+                    # Cell covered by a wide character, which is drawn when that character changes
+                    last_characters[i + 1] = COVERED
+                    last_foregrounds[i + 1] = foregrounds[i + 1]
+                    last_backgrounds[i + 1] = backgrounds[i + 1]
+                    last_attributes[i + 1] = attributes[i + 1]
+                x += width
+            if span_text != '':
+                self.output.draw_text (span_x, y, span_text, span_width, get_color (span_style[0]), get_color (span_style[1]), get_attributes (span_style[2]))
 
         if frame.cursor is None:
-            curses.curs_set (0)
+            self.output.set_cursor (None)
         else:
-            curses.curs_set (1)
             (cursor_x, cursor_y) = frame.cursor
             cursor_x = min (cursor_x, max_width - 1)
             cursor_y = min (cursor_y, max_lines - 1)
-            self.screen.move (cursor_y, cursor_x)
-        self.screen.refresh ()
+            self.output.set_cursor ((cursor_x, cursor_y))
+
+        self.cells_written = cells_written
+        self.bytes_written = self.output.flush ()
+
+        # Draw everything again if the output has lost track of what is on the screen
+        if self.output.invalid:
+            self._schedule_refresh (False)
+        if self.log_stats:
+            if self.output.counts_all_bytes:
+                bytes_description = 'bytes'
+            else:
+                bytes_description = 'bytes (text only)'
+            open ('debug.log', 'a').write ('Refresh wrote {} cells, {} {}\n'.format (self.cells_written, self.bytes_written, bytes_description))
 
     def handle_input (self):
+        have_input = False
         while True:
             key = self.screen.getch ()
             if key == -1:
-                self.refresh () # FIXME: Do only when contents changed
+                # Show the effect of input immediately
+                if have_input:
+                    self._schedule_refresh (True)
                 return
+            have_input = True
             if key >= 0x20 and key <= 0x7F:
                 self.handle_event (CharacterInputEvent (key)) # FIXME: Handle UTF-8
             elif key == ord ('\n'):
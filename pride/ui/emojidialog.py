@@ -6,7 +6,6 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
-import unicodedata
 import xml.etree.ElementTree as ET
 
 from .widget import Widget
@@ -98,11 +97,13 @@ class EmojiDialog (Widget):
         else:
             return False
 
+        self.invalidate ()
         return True
 
     def handle_character_event (self, event):
         self.filter += chr (event.character)
         self.selected = (0, 0)
+        self.invalidate ()
         return True
 
     def render (self, frame, theme):
@@ -152,9 +153,7 @@ class EmojiDialog (Widget):
                 else:
                     ch = ' '
                 character_index += 1
-                text += ch + '\uFE0F' # Variation selector 16 - Emoji form
-                if unicodedata.east_asian_width (ch) not in ('W', 'F'): # Defined in http://www.unicode.org/reports/tr11/#
-                    text += ' '
+                text += ch + '\uFE0F' # Variation selector 16 - Emoji form, always two columns wide
                 if self.selected == (r, c) or self.selected == (r, c + 1):
                     text += '┃'
                 else:
@@ -6,108 +6,313 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
-import unicodedata
-
-class Pixel:
-    def __init__ (self):
-        self.character = None
-        self.foreground = None
-        self.background = None
-
-    def set_value (self, character, foreground = None, background = None):
-        self.character = character
-        self.foreground = foreground
-        self.background = background
-
-    def copy (self, pixel):
-        if pixel.character is not None:
-            self.character = pixel.character
-        if pixel.foreground is not None:
-            self.foreground = pixel.foreground
-        if pixel.background is not None:
-            self.background = pixel.background
-
-    def is_wide (self):
-        return unicodedata.east_asian_width (self.character[0]) in ('W', 'F')
+import array
+
+from . import unicodewidth
+
+# Frames store characters and colors as indexes into these tables.
+# Index 0 is None, i.e. a cell that has not been drawn to.
+_characters = [ None ]
+_character_indexes = { None: 0 }
+_character_widths = array.array ('B', [ 1 ])
+_colors = [ None ]
+_color_indexes = { None: 0 }
+
+# Character index of the cell after a wide character, which is covered by it
+COVERED = 0xFFFFFFFE
+
+# Text attributes, combined as flags
+BOLD = 0x01
+UNDERLINE = 0x02
+REVERSE = 0x04
+# Set in cells that have been drawn to, so plain text is different from a cell not drawn to
+_DRAWN = 0x80
+
+def get_character_index (character):
+    i = _character_indexes.get (character)
+    if i is None:
+        i = len (_characters)
+        _characters.append (character)
+        _character_indexes[character] = i
+        _character_widths.append (unicodewidth.get_cluster_width (character))
+    return i
+
+def get_character (index):
+    return _characters[index]
+
+def get_character_width (index):
+    return _character_widths[index]
+
+def get_color_index (color):
+    i = _color_indexes.get (color)
+    if i is None:
+        i = len (_colors)
+        _colors.append (color)
+        _color_indexes[color] = i
+    return i
+
+def get_color (index):
+    return _colors[index]
+
+def get_attributes (value):
+    return value & ~_DRAWN
+
+def _make_row (value, width):
+    return array.array ('I', [ value ]) * width
 
 class Frame:
-    def __init__ (self, width, height):
+    def __init__ (self, width, height, parent = None, x = 0, y = 0):
+        if parent is None:
+            # Cells are stored row by row
+            self.characters = _make_row (0, width * height)
+            self.foregrounds = _make_row (0, width * height)
+            self.backgrounds = _make_row (0, width * height)
+            self.attributes = _make_row (0, width * height)
+            self._offset = 0
+            self._stride = width
+            # Areas that have been drawn to, shared with all views
+            self._damage = []
+            # Areas that are covered by other widgets and must not be drawn to, shared with all views
+            self._occluders = []
+        else:
+            # Share the cells of the parent frame
+            self.characters = parent.characters
+            self.foregrounds = parent.foregrounds
+            self.backgrounds = parent.backgrounds
+            self.attributes = parent.attributes
+            self._offset = parent._offset + y * parent._stride + x
+            self._stride = parent._stride
+            self._damage = parent._damage
+            self._occluders = parent._occluders
         self.width = width
         self.height = height
-        self.buffer = []
-        for y in range (height):
-            line = []
-            for x in range (width):
-                line.append (Pixel ())
-            self.buffer.append (line)
         self.cursor = None
 
+    # Get a frame that draws directly into an area of this frame
+    def get_view (self, x, y, width, height):
+        x = min (max (x, 0), self.width)
+        y = min (max (y, 0), self.height)
+        width = max (min (width, self.width - x), 0)
+        height = max (min (height, self.height - y), 0)
+        return Frame (width, height, self, x, y)
+
+    # Get the area this frame covers in the root frame as (x, y, width, height)
+    def get_area (self):
+        if self._stride == 0:
+            return (0, 0, self.width, self.height)
+        return (self._offset % self._stride, self._offset // self._stride, self.width, self.height)
+
+    # Record that the cells in this frame have changed
+    def add_damage (self):
+        if self.width > 0 and self.height > 0:
+            self._damage.append (self.get_area ())
+
+    # Get the areas that have changed, this list is shared with all views
+    def get_damage (self):
+        return self._damage
+
+    # Get the areas that are not to be drawn to, this list is shared with all views
+    def get_occluders (self):
+        return self._occluders
+
+    # Get the parts of row y between x and x_end that are not covered as (start, end) pairs
+    def _get_uncovered (self, y, x, x_end):
+        if len (self._occluders) == 0:
+            return [ (x, x_end) ]
+        (frame_x, frame_y, _, _) = self.get_area ()
+        row = frame_y + y
+        spans = [ (x, x_end) ]
+        for (occluder_x, occluder_y, occluder_width, occluder_height) in self._occluders:
+            if row < occluder_y or row >= occluder_y + occluder_height:
+                continue
+            start = occluder_x - frame_x
+            end = start + occluder_width
+            clipped_spans = []
+            for (span_start, span_end) in spans:
+                if end <= span_start or start >= span_end:
+                    clipped_spans.append ((span_start, span_end))
+                    continue
+                if span_start < start:
+                    clipped_spans.append ((span_start, start))
+                if end < span_end:
+                    clipped_spans.append ((end, span_end))
+            spans = clipped_spans
+        return spans
+
+    def _is_covered (self, x, y):
+        if len (self._occluders) == 0:
+            return False
+        (frame_x, frame_y, _, _) = self.get_area ()
+        x += frame_x
+        y += frame_y
+        for (occluder_x, occluder_y, occluder_width, occluder_height) in self._occluders:
+            if x >= occluder_x and x < occluder_x + occluder_width and y >= occluder_y and y < occluder_y + occluder_height:
+                return True
+        return False
+
+    def copy_cells (self):
+        cells = []
+        for y in range (self.height):
+            start = self._offset + y * self._stride
+            end = start + self.width
+            cells.append ((self.characters[start:end], self.foregrounds[start:end], self.backgrounds[start:end], self.attributes[start:end]))
+        return cells
+
+    # Set cells from copy_cells (), starting at (x, y) in them
+    def set_cells (self, cells, x = 0, y = 0):
+        for y_ in range (min (self.height, len (cells) - y)):
+            (characters, foregrounds, backgrounds, attributes) = cells[y + y_]
+            start = self._offset + y_ * self._stride
+            for (span_start, span_end) in self._get_uncovered (y_, 0, self.width):
+                self.characters[start + span_start:start + span_end] = characters[x + span_start:x + span_end]
+                self.foregrounds[start + span_start:start + span_end] = foregrounds[x + span_start:x + span_end]
+                self.backgrounds[start + span_start:start + span_end] = backgrounds[x + span_start:x + span_end]
+                self.attributes[start + span_start:start + span_end] = attributes[x + span_start:x + span_end]
+
     def clear (self, color = None):
         self.fill (0, 0, self.width, self.height, background = color)
 
     def fill (self, x, y, width, height, character = ' ', foreground = None, background = None):
-        height = min (height, self.height)
-        width = min (width, self.width)
-        for y_ in range (y, height):
-            for x_ in range (x, width):
-                self.buffer[y_][x_].set_value (character, foreground, background)
+        x_end = min (x + width, self.width)
+        y_end = min (y + height, self.height)
+        x = max (x, 0)
+        y = max (y, 0)
+        if x >= x_end or y >= y_end:
+            return
+        width = x_end - x
+        # Values that are None are left unchanged
+        rows = []
+        for (cells, value) in ((self.characters, get_character_index (character)), (self.foregrounds, get_color_index (foreground)), (self.backgrounds, get_color_index (background))):
+            if value != 0:
+                rows.append ((cells, _make_row (value, width)))
+        if character is not None:
+            rows.append ((self.attributes, _make_row (_DRAWN, width)))
+        for y_ in range (y, y_end):
+            start = self._offset + y_ * self._stride
+            for (span_start, span_end) in self._get_uncovered (y_, x, x_end):
+                for (cells, row) in rows:
+                    if span_end - span_start == width:
+                        cells[start + span_start:start + span_end] = row
+                    else:
+                        cells[start + span_start:start + span_end] = row[:span_end - span_start]
+
+    # Mark all cells as not drawn to
+    def reset (self):
+        row = _make_row (0, self.width)
+        for y in range (self.height):
+            start = self._offset + y * self._stride
+            self.characters[start:start + self.width] = row
+            self.foregrounds[start:start + self.width] = row
+            self.backgrounds[start:start + self.width] = row
+            self.attributes[start:start + self.width] = row
 
     def composite (self, x, y, frame):
-        # FIXME: Make SubFrame that re-uses buffer?
         width = min (self.width - x, frame.width)
         height = min (self.height - y, frame.height)
+        if width <= 0 or height <= 0:
+            return
         for y_ in range (height):
-            source_line = frame.buffer[y_]
-            target_line = self.buffer[y + y_]
-            for x_ in range (width):
-                target_line[x + x_].copy (source_line[x_])
+            source_start = frame._offset + y_ * frame._stride
+            target_start = self._offset + (y + y_) * self._stride + x
+            # Cells that have not been drawn to in the source frame are left unchanged
+            spans = self._get_uncovered (y + y_, x, x + width)
+            for (source, target) in ((frame.characters, self.characters), (frame.foregrounds, self.foregrounds), (frame.backgrounds, self.backgrounds), (frame.attributes, self.attributes)):
+                row = source[source_start:source_start + width]
+                for (span_start, span_end) in spans:
+                    span_start -= x
+                    span_end -= x
+                    span = row[span_start:span_end]
+                    if 0 not in span:
+                        target[target_start + span_start:target_start + span_end] = span
+                    else:
+                        for (i, value) in enumerate (span):
+                            if value != 0:
+                                target[target_start + span_start + i] = value
 
-    def render_text (self, x, y, text, foreground = None, background = None):
-        if y >= self.height:
+    def render_text (self, x, y, text, foreground = None, background = None, attributes = 0):
+        if y < 0 or y >= self.height:
             return
-        line = self.buffer[y]
+        attributes |= _DRAWN
+        start = self._offset + y * self._stride
+        if foreground is not None:
+            foreground = get_color_index (foreground)
+        if background is not None:
+            background = get_color_index (background)
+        covered = len (self._occluders) > 0
         x_ = x
-        for c in text:
+        for c in unicodewidth.get_clusters (text):
             if x_ >= self.width:
                 break
-            if background is None:
-                background = line[x_].background
-            line[x_].set_value (c, foreground, background)
-            if ord (c) >= 0xFE00 and ord (c) <= 0xFE0F: # Variation selectors
-                if x_ > x and line[x_ - 1].character is not None:
-                    line[x_ - 1].character += c
-            elif unicodedata.east_asian_width (c) in ('W', 'F'):
-                x_ += 2
-            else:
-                x_ += 1
+            character = get_character_index (c)
+            if x_ < 0:
+                x_ += _character_widths[character]
+                continue
+            i = start + x_
+            width = _character_widths[character]
+            if not covered or not self._is_covered (x_, y):
+                # Don't leave half of a wide character that is drawn over
+                if self.characters[i] == COVERED and x_ > 0:
+                    self.characters[i - 1] = get_character_index (' ')
+                if x_ + width < self.width and self.characters[i + width] == COVERED:
+                    self.characters[i + width] = get_character_index (' ')
+                self.characters[i] = character
+                self.attributes[i] = attributes
+                if foreground is not None:
+                    self.foregrounds[i] = foreground
+                if background is not None:
+                    self.backgrounds[i] = background
+                if width == 2 and x_ + 1 < self.width and (not covered or not self._is_covered (x_ + 1, y)):
+                    self.characters[i + 1] = COVERED
+                    self.attributes[i + 1] = attributes
+                    if foreground is not None:
+                        self.foregrounds[i + 1] = foreground
+                    if background is not None:
+                        self.backgrounds[i + 1] = background
+            x_ += width
 
     def render_image (self, x, y, lines, color_lines = None, color_map = None):
+        default_colors = (get_color_index ('#FFFFFF'), get_color_index ('#000000'))
         for (i, source_line) in enumerate (lines):
             if y + i >= self.height:
                 return
-            line = self.buffer[y + i]
+            start = self._offset + (y + i) * self._stride
             for (j, c) in enumerate (source_line):
-                (foreground, background) = ('#FFFFFF', '#000000')
+                (foreground, background) = default_colors
                 if color_lines is not None:
                     color_code = color_lines[i][j]
-                    (foreground, background) = color_map.get (color_code, ('#FFFFFF', '#000000'))
+                    colors = color_map.get (color_code)
+                    if colors is not None:
+                        (foreground, background) = (get_color_index (colors[0]), get_color_index (colors[1]))
                 if x + j >= self.width:
                     break
-                line[x + j].set_value (c, foreground, background)
+                if self._is_covered (x + j, y + i):
+                    continue
+                self.characters[start + x + j] = get_character_index (c)
+                self.foregrounds[start + x + j] = foreground
+                self.backgrounds[start + x + j] = background
+                self.attributes[start + x + j] = _DRAWN
+
+    def _set_value (self, x, y, character, foreground, background):
+        if self._is_covered (x, y):
+            return
+        i = self._offset + y * self._stride + x
+        self.characters[i] = get_character_index (character)
+        self.foregrounds[i] = get_color_index (foreground)
+        self.backgrounds[i] = get_color_index (background)
+        self.attributes[i] = _DRAWN
 
     def render_horizontal_bar (self, x, y, width, start_fraction = 8, end_fraction = 8, foreground = '#FFFFFF', background = '#000000'):
         if y >= self.height:
             return
-        line = self.buffer[y]
         for i in range (width):
             if x + i >= self.width:
                 break
             if i == 0 and start_fraction > 0 and start_fraction < 8:
-                line [x + i].set_value (chr (0x2588 + start_fraction), background, foreground)
+                self._set_value (x + i, y, chr (0x2588 + start_fraction), background, foreground)
             elif i == width - 1 and end_fraction > 0 and end_fraction < 8:
-                line [x + i].set_value (chr (0x2588 + (8 - end_fraction)), foreground, background)
+                self._set_value (x + i, y, chr (0x2588 + (8 - end_fraction)), foreground, background)
             else:
-                line [x + i].set_value ('█', foreground, background)
+                self._set_value (x + i, y, '█', foreground, background)
 
     def render_vertical_bar (self, x, y, height, start_fraction = 0, end_fraction = 0, foreground = '#FFFFFF', background = '#000000'):
         if x >= self.width:
@@ -115,10 +320,9 @@ class Frame:
         for i in range (height):
             if y + i >= self.height:
                 break
-            line = self.buffer[y + i]
             if i == 0 and start_fraction > 0 and start_fraction < 8:
-                line [x].set_value (chr (0x2580 + start_fraction), foreground, background)
+                self._set_value (x, y + i, chr (0x2580 + start_fraction), foreground, background)
             elif i == height - 1 and end_fraction > 0 and end_fraction < 8:
-                line [x].set_value (chr (0x2580 + (8 - end_fraction)), background, foreground)
+                self._set_value (x, y + i, chr (0x2580 + (8 - end_fraction)), background, foreground)
             else:
-                line [x].set_value ('█', foreground, background)
+                self._set_value (x, y + i, '█', foreground, background)
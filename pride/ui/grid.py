@@ -6,23 +6,52 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
+import math
+
 from .container import Container
-from .frame import Frame
 from .keyinputevent import Key
 from .keyinputevent import KeyInputEvent
 from .widget import Widget
 
+# Share the available space between tracks in proportion to their scale. Each track gets
+# the whole part of its share, and the space left over goes to the tracks with the
+# largest remaining parts.
+def _allocate (sizes, scales, available):
+    sizes = list (sizes)
+    total_scale = sum (scales)
+    available -= sum (sizes)
+    if total_scale <= 0.0 or available <= 0:
+        return sizes
+
+    remaining = available
+    remainders = []
+    for (i, scale) in enumerate (scales):
+        requested = available * scale / total_scale
+        whole = math.floor (requested)
+        sizes[i] += whole
+        remaining -= whole
+        if requested > whole:
+            remainders.append ((whole - requested, i))
+    remainders.sort ()
+    for (_, i) in remainders[:remaining]:
+        sizes[i] += 1
+    return sizes
+
 class Grid (Container):
     def __init__ (self):
         Container.__init__ (self)
         self.children = {}
+        self._tracks = None
+        self._layout = None
         self.set_scale (1.0, 1.0)
 
     def add_child (self, child, x, y):
         assert (isinstance (child, Widget))
         self.children[(x, y)] = child
+        child.parent = self
         if self.focus_child is None:
             self.focus (child)
+        self.invalidate_size ()
 
     def append_row (self, child):
         assert (isinstance (child, Widget))
@@ -40,7 +69,16 @@ class Grid (Container):
                 child_x = x + 1
         self.add_child (child, child_x, 0)
 
-    def get_size (self):
+    def invalidate_size (self):
+        self._tracks = None
+        self._layout = None
+        Container.invalidate_size (self)
+
+    # Get the size and scale of each column and row
+    def _get_tracks (self):
+        if self._tracks is not None:
+            return self._tracks
+
         grid_width = 0
         grid_height = 0
         for ((x, y), child) in self.children.items ():
@@ -51,25 +89,52 @@ class Grid (Container):
             if y >= grid_height:
                 grid_height = y + 1
 
-        row_heights = [0] * grid_height
         column_widths = [0] * grid_width
+        row_heights = [0] * grid_height
+        column_scales = [0.0] * grid_width
+        row_scales = [0.0] * grid_height
         for ((x, y), child) in self.children.items ():
             if not child.visible:
                 continue
             (w, h) = child.get_size ()
             if w > column_widths[x]:
                 column_widths[x] = w
+            if child.x_scale > column_scales[x]:
+                column_scales[x] = child.x_scale
             if h > row_heights[y]:
                 row_heights[y] = h
+            if child.y_scale > row_scales[y]:
+                row_scales[y] = child.y_scale
 
-        width = 0
-        for x in range (grid_width):
-            width += column_widths[x]
-        height = 0
-        for y in range (grid_height):
-            height += row_heights[y]
+        self._tracks = (column_widths, row_heights, column_scales, row_scales)
+        return self._tracks
+
+    # Get the area for each visible child as (child, x, y, width, height)
+    def _get_layout (self, width, height):
+        if self._layout is not None and self._layout[0] == (width, height):
+            return self._layout[1]
+
+        (column_widths, row_heights, column_scales, row_scales) = self._get_tracks ()
+        column_widths = _allocate (column_widths, column_scales, width)
+        row_heights = _allocate (row_heights, row_scales, height)
+        column_offsets = [0]
+        for w in column_widths:
+            column_offsets.append (column_offsets[-1] + w)
+        row_offsets = [0]
+        for h in row_heights:
+            row_offsets.append (row_offsets[-1] + h)
+
+        layout = []
+        for ((x, y), child) in self.children.items ():
+            if not child.visible:
+                continue
+            layout.append ((child, column_offsets[x], row_offsets[y], column_widths[x], row_heights[y]))
+        self._layout = ((width, height), layout)
+        return layout
 
-        return (width, height)
+    def get_size (self):
+        (column_widths, row_heights, _, _) = self._get_tracks ()
+        return (sum (column_widths), sum (row_heights))
 
     def focus_next (self):
         return True
@@ -84,107 +149,15 @@ class Grid (Container):
 
     def render (self, frame, theme):
         frame.clear ()
+        self.render_children (frame, theme, True)
 
-        # Work out size of grid
-        width = 0
-        height = 0
-        for ((x, y), child) in self.children.items ():
-            if not child.visible:
-                continue
-            if x >= width:
-                width = x + 1
-            if y >= height:
-                height = y + 1
-
-        # Get size and scale for each child
-        row_heights = [0] * height
-        column_widths = [0] * width
-        row_scales = [0.0] * height
-        column_scales = [0.0] * width
-        for ((x, y), child) in self.children.items ():
-            if not child.visible:
-                continue
-            (w, h) = child.get_size ()
-            if w > column_widths[x]:
-                column_widths[x] = w
-            if child.x_scale > column_scales[x]:
-                column_scales[x] = child.x_scale
-            if h > row_heights[y]:
-                row_heights[y] = h
-            if child.y_scale > row_scales[y]:
-                row_scales[y] = child.y_scale
+    def render_background (self, frame, theme):
+        Container.render_background (self, frame, theme)
+        frame.clear ()
 
-        # Allocate rows
-        for y in range (height):
-            available = frame.width
-            total_scales = 0.0
-            for x in range (width):
-                total_scales += column_scales[x]
-                available -= column_widths[x]
-
-            if total_scales <= 0.0:
-                break
-
-            requested = []
-            for x in range (width):
-                requested += [available * column_scales[x] / total_scales]
-
-            # Allocate space fairly
-            while available > 0:
-                current_requested = 0.0
-                next_x = 0
-                for x in range (width):
-                    if requested[x] > current_requested:
-                        next_x = x
-                        current_requested = requested[x]
-                if current_requested <= 0.0:
-                    break
-                requested[next_x] = max (requested[next_x] - 1.0, 0.0)
-                column_widths[next_x] += 1
-                available -= 1
-
-        # Allocate columns
-        for x in range (width):
-            available = frame.height
-            total_scales = 0.0
-            for y in range (height):
-                total_scales += row_scales[y]
-                available -= row_heights[y]
-
-            if total_scales <= 0.0:
-                break
-
-            requested = []
-            for y in range (height):
-                requested += [available * row_scales[y] / total_scales]
-
-            # Allocate space fairly
-            while available > 0:
-                current_requested = 0.0
-                next_y = 0
-                for y in range (height):
-                    if requested[y] > current_requested:
-                        next_y = y
-                        current_requested = requested[y]
-                if current_requested <= 0.0:
-                    break
-                requested[next_y] = max (requested[next_y] - 1.0, 0.0)
-                row_heights[next_y] += 1
-                available -= 1
-
-        # Draw chldren
-        for ((x, y), child) in self.children.items ():
-            if not child.visible:
-                continue
-            x_offset = 0
-            for i in range (x):
-                x_offset += column_widths[i]
-            w = column_widths[x]
-            y_offset = 0
-            for i in range (y):
-                y_offset += row_heights[i]
-            h = row_heights[y]
-            child_frame = self.render_child (child, w, h, theme)
-            frame.composite (x_offset, y_offset, child_frame)
+    def render_children (self, frame, theme, force = False):
+        frame.cursor = None
+        for (child, x, y, width, height) in self._get_layout (frame.width, frame.height):
+            child_frame = self.render_child (child, frame, x, y, width, height, theme, force)
             if child is self.focus_child and child_frame.cursor is not None:
-                frame.cursor = (x_offset + child_frame.cursor[0], y_offset + child_frame.cursor[1])
+                frame.cursor = (x + child_frame.cursor[0], y + child_frame.cursor[1])
@@ -0,0 +1,110 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import asyncio
+import json
+import os
+
+from .textfile import write_lines
+
+# Time to collect operations before writing them
+_FLUSH_DELAY = 0.2
+
+# Operations that can be replayed
+_OPERATIONS = ('replace_text', 'insert', 'overwrite', 'split_line', 'merge_lines', 'delete_left', 'delete_right')
+
+# Records the operations done to a TextBuffer since its file was saved, so they
+# can be replayed if the editor exits before saving.
+# The journal is a line of JSON with the hash of the saved file, followed by
+# a line of JSON for each operation.
+class Journal:
+    def __init__ (self, path, buffer, base_hash):
+        self.path = path
+        self.buffer = buffer
+        self.base_hash = base_hash
+        # Operations that aren't in the saved file as (buffer version, JSON)
+        self.entries = []
+        self.unwritten = []
+        self.file = None
+        self.flush_handle = None
+        buffer.add_operation_callback (self._operation)
+
+    def _get_header (self):
+        return json.dumps ({ 'base': self.base_hash.hex () })
+
+    # Replay the operations in an existing journal.
+    # The journal is ignored if the file has changed since it was written.
+    def replay (self):
+        try:
+            lines = open (self.path).read ().split ('\n')
+        except FileNotFoundError:
+            return
+        try:
+            header = json.loads (lines[0])
+        except ValueError:
+            return
+        if header.get ('base') != self.base_hash.hex ():
+            return
+
+        # Operations are recorded again as they are replayed, replacing the old journal
+        self.buffer.begin_user_action ()
+        for line in lines[1:]:
+            try:
+                (name, args, kwargs) = json.loads (line)
+            except ValueError:
+                break # The last operation may not have been completely written
+            if name not in _OPERATIONS:
+                open ('debug.log', 'a').write ('Unknown journal operation {}\n'.format (name))
+                break
+            getattr (self.buffer, name) (*args, **kwargs)
+        self.buffer.end_user_action ()
+        self.flush ()
+
+    def _operation (self, name, args, kwargs):
+        entry = json.dumps ([ name, args, kwargs ])
+        self.entries.append ((self.buffer.version, entry))
+        self.unwritten.append (entry)
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_event_loop ().call_later (_FLUSH_DELAY, self.flush)
+
+    # Write any recorded operations to disk
+    def flush (self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel ()
+            self.flush_handle = None
+        if len (self.unwritten) == 0:
+            return
+        if self.file is None:
+            self.file = open (self.path, 'w')
+            self.file.write (self._get_header () + '\n')
+        self.file.write ('\n'.join (self.unwritten) + '\n')
+        self.unwritten = []
+        self.file.flush ()
+        os.fsync (self.file.fileno ())
+
+    # Called when version of the buffer with contents hash has been saved
+    def saved (self, version, base_hash):
+        self.base_hash = base_hash
+        self.entries = [ (v, entry) for (v, entry) in self.entries if v > version ]
+        self.unwritten = []
+        if self.flush_handle is not None:
+            self.flush_handle.cancel ()
+            self.flush_handle = None
+        if self.file is not None:
+            self.file.close ()
+            self.file = None
+
+        # Keep only the operations that happened after the save
+        if len (self.entries) == 0:
+            try:
+                os.remove (self.path)
+            except FileNotFoundError:
+                pass
+        else:
+            write_lines (self.path, [ self._get_header () ] + [ entry for (_, entry) in self.entries ] + [ '' ])
+            self.file = open (self.path, 'a')
@@ -0,0 +1,191 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import copy
+
+# Number of lines to store in each chunk, chunks are split when they get twice
+# this size and merged with a neighbour when they get smaller than a quarter.
+_CHUNK_SIZE = 512
+
+# A list of lines stored in chunks, so lines can be inserted and removed without
+# moving every line after them. A Fenwick tree over the chunk lengths is used to
+# find which chunk a line is in.
+class LineRope:
+    def __init__ (self, lines = ()):
+        lines = list (lines)
+        self._chunks = []
+        for i in range (0, len (lines), _CHUNK_SIZE):
+            self._chunks.append (lines[i:i + _CHUNK_SIZE])
+        self._rebuild_index ()
+
+    def _rebuild_index (self):
+        n_chunks = len (self._chunks)
+        self._tree = [0] * (n_chunks + 1)
+        for (i, chunk) in enumerate (self._chunks):
+            j = i + 1
+            self._tree[j] += len (chunk)
+            parent = j + (j & -j)
+            if parent <= n_chunks:
+                self._tree[parent] += self._tree[j]
+        self._length = 0
+        for chunk in self._chunks:
+            self._length += len (chunk)
+        self._top_step = 1
+        while self._top_step * 2 <= n_chunks:
+            self._top_step *= 2
+
+    def _update_index (self, chunk_index, delta):
+        j = chunk_index + 1
+        while j < len (self._tree):
+            self._tree[j] += delta
+            j += j & -j
+        self._length += delta
+
+    # Get the chunk containing line index as (chunk index, index in chunk)
+    def _find (self, index):
+        position = 0
+        step = self._top_step
+        while step > 0:
+            next_position = position + step
+            if next_position < len (self._tree) and self._tree[next_position] <= index:
+                position = next_position
+                index -= self._tree[next_position]
+            step //= 2
+        return (position, index)
+
+    def _get_index (self, index):
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError ('line index out of range')
+        return index
+
+    def __len__ (self):
+        return self._length
+
+    def __iter__ (self):
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __eq__ (self, other):
+        return list (self) == list (other)
+
+    def __repr__ (self):
+        return 'LineRope ({})'.format (repr (list (self)))
+
+    def __getitem__ (self, index):
+        if isinstance (index, slice):
+            return [ self[i] for i in range (*index.indices (self._length)) ]
+        (chunk_index, i) = self._find (self._get_index (index))
+        return self._chunks[chunk_index][i]
+
+    # Get a chunk that can be modified. Chunks only need to behave like a list
+    # until they are modified, so subclasses can convert them here.
+    def _get_writable_chunk (self, chunk_index):
+        return self._chunks[chunk_index]
+
+    def __setitem__ (self, index, line):
+        (chunk_index, i) = self._find (self._get_index (index))
+        self._get_writable_chunk (chunk_index)[i] = line
+
+    # Get a copy of the lines, that doesn't change when this does
+    def copy (self):
+        rope = copy.copy (self)
+        rope._chunks = [ chunk.copy () for chunk in self._chunks ]
+        rope._tree = self._tree.copy ()
+        return rope
+
+    def append (self, line):
+        self.insert (self._length, line)
+
+    def extend (self, lines):
+        for line in lines:
+            self.append (line)
+
+    def insert (self, index, line):
+        if index < 0:
+            index = max (index + self._length, 0)
+        index = min (index, self._length)
+
+        if len (self._chunks) == 0:
+            self._chunks.append ([ line ])
+            self._rebuild_index ()
+            return
+
+        if index == self._length:
+            (chunk_index, i) = (len (self._chunks) - 1, len (self._chunks[-1]))
+        else:
+            (chunk_index, i) = self._find (index)
+        chunk = self._get_writable_chunk (chunk_index)
+        chunk.insert (i, line)
+        if len (chunk) >= _CHUNK_SIZE * 2:
+            self._chunks[chunk_index:chunk_index + 1] = [ chunk[:_CHUNK_SIZE], chunk[_CHUNK_SIZE:] ]
+            self._rebuild_index ()
+        else:
+            self._update_index (chunk_index, 1)
+
+    def pop (self, index = -1):
+        (chunk_index, i) = self._find (self._get_index (index))
+        chunk = self._get_writable_chunk (chunk_index)
+        line = chunk.pop (i)
+        if len (chunk) < _CHUNK_SIZE // 4 and len (self._chunks) > 1:
+            # Merge into a neighbour
+            if chunk_index + 1 < len (self._chunks):
+                self._chunks[chunk_index:chunk_index + 2] = [ chunk + self._get_writable_chunk (chunk_index + 1) ]
+            else:
+                self._chunks[chunk_index - 1:chunk_index + 1] = [ self._get_writable_chunk (chunk_index - 1) + chunk ]
+            self._rebuild_index ()
+        elif len (chunk) == 0:
+            self._chunks.pop (chunk_index)
+            self._rebuild_index ()
+        else:
+            self._update_index (chunk_index, -1)
+        return line
+
+if __name__ == '__main__':
+    import random
+
+    r = LineRope ()
+    assert (r == [])
+    assert (len (r) == 0)
+
+    r.append ('A')
+    r.append ('C')
+    r.insert (1, 'B')
+    assert (r == ['A', 'B', 'C'])
+    assert (r[0] == 'A')
+    assert (r[-1] == 'C')
+    assert (r[1:] == ['B', 'C'])
+
+    r[1] = 'X'
+    assert (r == ['A', 'X', 'C'])
+
+    assert (r.pop (0) == 'A')
+    assert (r.pop () == 'C')
+    assert (r == ['X'])
+
+    # Compare against a list across chunk splits and merges
+    lines = []
+    r = LineRope ()
+    for i in range (20000):
+        if len (lines) > 0 and random.random () < 0.4:
+            index = random.randrange (len (lines))
+            assert (r.pop (index) == lines.pop (index))
+        else:
+            index = random.randint (0, len (lines))
+            lines.insert (index, str (i))
+            r.insert (index, str (i))
+    assert (r == lines)
+    for i in range (0, len (lines), 97):
+        assert (r[i] == lines[i])
+    assert (LineRope (lines) == lines)
+
+    snapshot = r.copy ()
+    r.pop (0)
+    r.insert (100, 'X')
+    assert (snapshot == lines)
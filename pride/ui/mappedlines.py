@@ -0,0 +1,157 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import array
+import codecs
+import itertools
+import mmap
+
+from .linerope import LineRope, _CHUNK_SIZE
+
+# Lines start to end in a mapped file, these are decoded each time they are used
+class _MappedChunk:
+    def __init__ (self, lines, start, end):
+        self.lines = lines
+        self.start = start
+        self.end = end
+
+    # Chunks aren't changed, so copies can share them
+    def copy (self):
+        return self
+
+    def __len__ (self):
+        return self.end - self.start
+
+    def __iter__ (self):
+        for i in range (self.start, self.end):
+            yield self.lines._get_file_line (i)
+
+    def __getitem__ (self, index):
+        if isinstance (index, slice):
+            return [ self.lines._get_file_line (self.start + i) for i in range (*index.indices (len (self))) ]
+        if index < 0:
+            index += len (self)
+        return self.lines._get_file_line (self.start + index)
+
+# Lines of a file that is mapped into memory. Only the offsets of each line are
+# stored, and lines are decoded when they are used. Modified lines are stored
+# in the rope and the file is left unchanged.
+# The file is indexed in steps using index () so large files can be loaded in the background.
+# Only encodings where b'\n' is always a newline can be used.
+class MappedLines (LineRope):
+    def __init__ (self, path, encoding = 'utf-8', newline = '\n'):
+        LineRope.__init__ (self)
+        self._encoding = encoding
+        self._strip_cr = newline == '\r\n'
+        f = open (path, 'rb')
+        f.seek (0, 2)
+        self.size = f.tell ()
+        if self.size > 0:
+            self._map = mmap.mmap (f.fileno (), 0, access = mmap.ACCESS_READ)
+        else:
+            self._map = b''
+        f.close ()
+        # Offset of the start of each line found
+        self._offsets = array.array ('Q')
+        # Offset of the line after the last one found, and how far we have checked it for a newline
+        self._line_start = 0
+        self._scan_position = 0
+        self.complete = False
+
+        # Skip the byte order mark
+        if encoding == 'utf-8-sig':
+            self._encoding = 'utf-8'
+            if self._map[:len (codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+                self._line_start = self._scan_position = len (codecs.BOM_UTF8)
+
+    def _get_file_line (self, index):
+        start = self._offsets[index]
+        if index + 1 < len (self._offsets):
+            end = self._offsets[index + 1] - 1
+        else:
+            end = self._line_start - 1
+        # The last line doesn't have a newline
+        if self._strip_cr and end > start and self._map[end - 1] == ord ('\r') and end < self.size:
+            end -= 1
+        return self._map[start:end].decode (self._encoding, errors = 'surrogateescape')
+
+    def _get_writable_chunk (self, chunk_index):
+        chunk = self._chunks[chunk_index]
+        if isinstance (chunk, _MappedChunk):
+            chunk = list (chunk)
+            self._chunks[chunk_index] = chunk
+        return chunk
+
+    # Find up to max_bytes more of the file lines, or the rest of the file if None.
+    # Returns the number of lines added.
+    def index (self, max_bytes = None):
+        if self.complete:
+            return 0
+
+        end = self.size
+        if max_bytes is not None:
+            end = min (self._scan_position + max_bytes, self.size)
+        data = self._map[self._scan_position:end]
+
+        # Only use complete lines until the end of the file
+        n_lines = len (self._offsets)
+        newline = data.rfind (b'\n')
+        if newline >= 0:
+            segments = data[:newline].split (b'\n')
+            starts = list (itertools.accumulate ([ len (segment) + 1 for segment in segments ], initial = self._scan_position))
+            self._offsets.append (self._line_start)
+            self._offsets.extend (starts[1:-1])
+            self._line_start = self._scan_position + newline + 1
+        self._scan_position = end
+        if end == self.size:
+            self._offsets.append (self._line_start)
+            self._line_start = self.size + 1
+            self.complete = True
+
+        # Add new lines to the end
+        for start in range (n_lines, len (self._offsets), _CHUNK_SIZE):
+            self._chunks.append (_MappedChunk (self, start, min (start + _CHUNK_SIZE, len (self._offsets))))
+        self._rebuild_index ()
+
+        return len (self._offsets) - n_lines
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+
+    def check (data, max_bytes, encoding = 'utf-8', newline = '\n'):
+        (fd, path) = tempfile.mkstemp ()
+        os.write (fd, data)
+        os.close (fd)
+        lines = MappedLines (path, encoding, newline)
+        while not lines.complete:
+            lines.index (max_bytes)
+        os.remove (path)
+        assert (lines == data.decode (encoding).split (newline))
+        return lines
+
+    for max_bytes in (None, 1, 3, 1024):
+        check (b'', max_bytes)
+        check (b'\n', max_bytes)
+        check (b'A', max_bytes)
+        check (b'A\nBC\n\nD', max_bytes)
+        check (b'A\nBC\n\nD\n', max_bytes)
+        check ('中\né'.encode (), max_bytes)
+        check (b'A\r\nBC\r\n\r\nD\r', max_bytes, newline = '\r\n')
+        check ('\ufeff中\né'.encode (), max_bytes, encoding = 'utf-8-sig')
+        check ('é\nß\n'.encode ('latin-1'), max_bytes, encoding = 'latin-1')
+
+    # Edits are kept in the rope
+    lines = check (''.join ('{}\n'.format (i) for i in range (2000)).encode (), 100)
+    lines[1000] = 'X'
+    lines.insert (5, 'Y')
+    lines.pop (0)
+    assert (lines[999] == '999')
+    assert (lines[1000] == 'X')
+    assert (lines[4] == 'Y')
+    assert (len (lines) == 2001)
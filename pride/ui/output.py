@@ -0,0 +1,33 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+class Output:
+    def __init__ (self):
+        # Set when the contents of the terminal are unknown and need to be completely redrawn
+        self.invalid = True
+        # False if flush only counts the text drawn, not the escape sequences sent
+        self.counts_all_bytes = True
+
+    def get_size (self):
+        return (0, 0)
+
+    # Called when starting to draw everything again
+    def clear (self):
+        self.invalid = False
+
+    # Draw text starting at (x, y) that covers width cells, with attributes from frame.BOLD etc
+    def draw_text (self, x, y, text, width, foreground, background, attributes = 0):
+        pass
+
+    def set_cursor (self, cursor):
+        pass
+
+    # Send drawn text to the terminal, returns the number of bytes written
+    # (see counts_all_bytes)
+    def flush (self):
+        return 0
@@ -0,0 +1,156 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import builtins
+import keyword
+import re
+
+from .textchange import ChangeKind
+
+_TOKEN_RE = re.compile (r'''(?P<comment>\#.*)|(?P<string>[rRbBuUfF]{0,2}(?:\'\'\'|"""|'|"))|(?P<number>\b(?:0[xXoObB][0-9a-fA-F_]+|\d[\d_]*\.?[\d_]*(?:[eE][+-]?\d+)?[jJ]?)|\.\d[\d_]*(?:[eE][+-]?\d+)?[jJ]?)|(?P<decorator>^\s*@[\w.]+)|(?P<name>[^\W\d]\w*)''')
+
+# Patterns to find the end of a string started with each quote
+_STRING_END_RE = { "'''": re.compile (r"(?:\\.|[^\\])*?'''"),
+                   '"""': re.compile (r'(?:\\.|[^\\])*?"""'),
+                   "'":   re.compile (r"(?:\\.|[^\\'])*'"),
+                   '"':   re.compile (r'(?:\\.|[^\\"])*"') }
+
+_KEYWORDS = set (keyword.kwlist)
+_BUILTINS = set (dir (builtins))
+
+# Highlights Python code in a TextBuffer.
+# The lexer state at the end of each line is cached (the quote of the string
+# that is still open or ''), so after an edit only the changed lines and the
+# lines after them whose state changes need to be lexed again.
+class PythonHighlighter:
+    def __init__ (self, buffer):
+        self.buffer = buffer
+        # State at the end of each line, None if not known
+        self.states = []
+        # First line that needs to be lexed again
+        self.first_invalid = 0
+        buffer.add_changed_callback (self._buffer_changed)
+
+    def _buffer_changed (self, change):
+        if change.kind == ChangeKind.ALL:
+            self.states = []
+            self.first_invalid = 0
+            return
+        # Forget the states of the changed lines, and move the ones after
+        old_end = max (change.end - change.line_delta, change.start)
+        self.states[change.start:old_end] = [ None ] * (change.end - change.start)
+        self.first_invalid = min (self.first_invalid, change.start)
+
+    # Get the spans of line y to style and the state at the end as ([(start, end, style)], state)
+    def _lex (self, line, state):
+        spans = []
+        offset = 0
+
+        # Finish string from previous line
+        if state != '':
+            (offset, state) = self._lex_string (line, 0, state)
+            spans.append ((0, offset, 'string'))
+            if state != '':
+                return (spans, state)
+
+        previous_name = None
+        while True:
+            match = _TOKEN_RE.search (line, offset)
+            if match is None:
+                break
+            kind = match.lastgroup
+            (start, offset) = match.span ()
+            if kind == 'string':
+                quote = match.group ().lstrip ('rRbBuUfF')
+                (offset, state) = self._lex_string (line, offset, quote)
+                spans.append ((start, offset, 'string'))
+                if state != '':
+                    break
+            elif kind == 'name':
+                name = match.group ()
+                if previous_name in ('def', 'class'):
+                    spans.append ((start, offset, 'definition'))
+                elif name in _KEYWORDS:
+                    spans.append ((start, offset, 'keyword'))
+                elif name in _BUILTINS:
+                    spans.append ((start, offset, 'builtin'))
+                previous_name = name
+                continue
+            else:
+                spans.append ((start, offset, kind))
+            previous_name = None
+
+        return (spans, state)
+
+    # Lex a string starting at offset, returns the end offset and the quote if the string continues onto the next line
+    def _lex_string (self, line, offset, quote):
+        match = _STRING_END_RE[quote].match (line, offset)
+        if match is not None:
+            return (match.end (), '')
+        # Triple quoted strings and escaped newlines continue
+        if len (quote) == 3 or (len (line) - len (line.rstrip ('\\'))) % 2 == 1:
+            return (len (line), quote)
+        return (len (line), '')
+
+    def _get_entry_state (self, y):
+        if y == 0:
+            return ''
+        return self.states[y - 1]
+
+    # Make sure the states up to line y are known
+    def _update_states (self, y):
+        n_lines = len (self.buffer.lines)
+        if len (self.states) < n_lines:
+            self.states.extend ([ None ] * (n_lines - len (self.states)))
+        elif len (self.states) > n_lines:
+            del self.states[n_lines:]
+        y = min (y, n_lines)
+
+        while self.first_invalid < y:
+            i = self.first_invalid
+            (_, state) = self._lex (self.buffer.lines[i], self._get_entry_state (i))
+            old_state = self.states[i]
+            self.states[i] = state
+            # If the state didn't change then the following lines are correct up to the next unknown one
+            if state == old_state and i + 1 < n_lines and self.states[i + 1] is not None:
+                try:
+                    self.first_invalid = self.states.index (None, i + 1)
+                except ValueError:
+                    self.first_invalid = n_lines
+            else:
+                self.first_invalid = i + 1
+
+    # Get the parts of line y to style as [(start, end, style)]
+    def get_spans (self, y):
+        self._update_states (y)
+        (spans, _) = self._lex (self.buffer.lines[y], self._get_entry_state (y))
+        return spans
+
+if __name__ == '__main__':
+    from .textbuffer import TextBuffer
+
+    b = TextBuffer ()
+    h = PythonHighlighter (b)
+    b.lines = ['def foo (x): # Comment', '    return """A', 'B', 'C""" + len ("x\\"y") + 0x1F']
+    assert (h.get_spans (0) == [(0, 3, 'keyword'), (4, 7, 'definition'), (13, 22, 'comment')])
+    assert (h.get_spans (1) == [(4, 10, 'keyword'), (11, 15, 'string')])
+    assert (h.get_spans (2) == [(0, 1, 'string')])
+    assert (h.get_spans (3) == [(0, 4, 'string'), (7, 10, 'builtin'), (12, 18, 'string'), (22, 26, 'number')])
+
+    # Closing the string changes the following lines
+    b.insert (1, 1, '"""')
+    assert (b.lines[1] == ' """   return """A')
+    assert (h.get_spans (1) == [(1, 17, 'string')])
+    assert (h.get_spans (2) == [])
+    assert (h.get_spans (3) == [(1, 26, 'string')])
+
+    # Lines after a change are lexed again only until the state matches
+    h.get_spans (3)
+    b.overwrite (0, 0, 'x')
+    h.get_spans (3)
+    assert (h.first_invalid == 3)
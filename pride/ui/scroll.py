@@ -15,17 +15,23 @@ class Scroll (Widget):
         Widget.__init__ (self)
         self.start = 0
         self.end = 1
+        self.opaque = True
         self.set_scale (0.0, 1.0)
 
     def set_position (self, start, end):
-        self.start = max (start, 0.0)
-        self.end = min (end, 1.0)
+        start = max (start, 0.0)
+        end = min (end, 1.0)
+        if (start, end) == (self.start, self.end):
+            return
+        self.start = start
+        self.end = end
+        self.invalidate ()
 
     def get_size (self):
         return (1, 0)
 
     def render (self, frame, theme):
-        frame.clear ()
+        frame.clear (theme.text_background)
         start = frame.height * self.start
         end = frame.height * self.end
         y = math.floor (start)
@@ -0,0 +1,151 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import bisect
+
+from .textchange import ChangeKind
+
+def _find_all (line, query):
+    matches = []
+    offset = line.find (query)
+    while offset >= 0:
+        matches.append (offset)
+        offset = line.find (query, offset + len (query))
+    return matches
+
+# Finds a piece of text in a TextBuffer.
+# The offsets of the matches in each line are kept, and only the lines that
+# change are searched again.
+class SearchIndex:
+    def __init__ (self, buffer):
+        self.buffer = buffer
+        self.query = ''
+        # Offsets of matches in each line
+        self.line_matches = []
+        # Lines that contain matches, in order
+        self.matching_lines = []
+        buffer.add_changed_callback (self._buffer_changed)
+
+    def set_query (self, query):
+        if query == self.query:
+            return
+        self.query = query
+        self._search_all ()
+
+    def _search_all (self):
+        if self.query == '':
+            self.line_matches = []
+            self.matching_lines = []
+            return
+        query = self.query
+        self.line_matches = [ _find_all (line, query) if query in line else [] for line in self.buffer.lines ]
+        self.matching_lines = [ y for (y, matches) in enumerate (self.line_matches) if len (matches) > 0 ]
+
+    def _buffer_changed (self, change):
+        if self.query == '':
+            return
+        if change.kind == ChangeKind.ALL or len (self.line_matches) + change.line_delta != len (self.buffer.lines):
+            self._search_all ()
+            return
+
+        # Search the changed lines again
+        old_end = max (change.end - change.line_delta, change.start)
+        lines = self.buffer.lines
+        self.line_matches[change.start:old_end] = [ _find_all (lines[y], self.query) for y in range (change.start, change.end) ]
+
+        # Replace the changed lines and move the ones after
+        start = bisect.bisect_left (self.matching_lines, change.start)
+        end = bisect.bisect_left (self.matching_lines, old_end)
+        changed = [ y for y in range (change.start, change.end) if len (self.line_matches[y]) > 0 ]
+        if change.line_delta == 0:
+            self.matching_lines[start:end] = changed
+        else:
+            self.matching_lines[start:] = changed + [ y + change.line_delta for y in self.matching_lines[end:] ]
+
+    # Get the offsets of matches in line y
+    def get_matches (self, y):
+        if y >= len (self.line_matches):
+            return []
+        return self.line_matches[y]
+
+    def get_n_matches (self):
+        n_matches = 0
+        for y in self.matching_lines:
+            n_matches += len (self.line_matches[y])
+        return n_matches
+
+    # Get the first match after offset in line y as (line, offset), wrapping around to the start.
+    # Returns None if there are no matches.
+    def find_next (self, y, offset):
+        for match in self.get_matches (y):
+            if match > offset:
+                return (y, match)
+        i = bisect.bisect_right (self.matching_lines, y)
+        if i < len (self.matching_lines):
+            y = self.matching_lines[i]
+        elif len (self.matching_lines) > 0:
+            y = self.matching_lines[0]
+        else:
+            return None
+        return (y, self.line_matches[y][0])
+
+    # Get the last match before offset in line y as (line, offset), wrapping around to the end.
+    # Returns None if there are no matches.
+    def find_previous (self, y, offset):
+        for match in reversed (self.get_matches (y)):
+            if match < offset:
+                return (y, match)
+        i = bisect.bisect_left (self.matching_lines, y)
+        if i > 0:
+            y = self.matching_lines[i - 1]
+        elif len (self.matching_lines) > 0:
+            y = self.matching_lines[-1]
+        else:
+            return None
+        return (y, self.line_matches[y][-1])
+
+    # Replace all matches with text as a single change
+    def replace_all (self, text):
+        if self.query == '':
+            return
+        self.buffer.begin_user_action ()
+        for y in list (self.matching_lines):
+            # Replace from the end so the offsets don't move
+            for offset in reversed (self.line_matches[y]):
+                self.buffer.replace_text (y, offset, offset + len (self.query), text)
+        self.buffer.end_user_action ()
+
+if __name__ == '__main__':
+    from .textbuffer import TextBuffer
+
+    b = TextBuffer ()
+    b.lines = ['foo bar foo', 'bar', 'baz foo']
+    s = SearchIndex (b)
+    s.set_query ('foo')
+    assert (s.matching_lines == [0, 2])
+    assert (s.get_matches (0) == [0, 8])
+    assert (s.get_n_matches () == 3)
+    assert (s.find_next (0, 0) == (0, 8))
+    assert (s.find_next (0, 8) == (2, 4))
+    assert (s.find_next (2, 4) == (0, 0))
+    assert (s.find_previous (0, 0) == (2, 4))
+    assert (s.find_previous (1, 0) == (0, 8))
+
+    # Only changed lines are searched again
+    b.insert (0, 1, 'foo')
+    assert (s.matching_lines == [0, 1, 2])
+    b.split_line (0, 0)
+    assert (s.matching_lines == [1, 2, 3])
+    b.merge_lines (0)
+    assert (s.matching_lines == [0, 1, 2])
+    b.delete_right (0, 1)
+    assert (s.matching_lines == [0, 2])
+
+    s.replace_all ('x')
+    assert (b.lines == ['x bar x', 'oobar', 'baz x'])
+    assert (s.matching_lines == [])
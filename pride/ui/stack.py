@@ -6,12 +6,18 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
-from .frame import Frame
 from .container import Container
 
+def _overlaps (a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def _contains (a, b):
+    return b[0] >= a[0] and b[0] + b[2] <= a[0] + a[2] and b[1] >= a[1] and b[1] + b[3] <= a[1] + a[3]
+
 class Stack (Container):
     def __init__ (self):
         Container.__init__ (self)
+        self.overlapping_children = True
         self.children = []
         self.set_scale (1.0, 1.0)
 
@@ -25,7 +31,9 @@ class Stack (Container):
 
     def add_child (self, child):
         self.children.append (child)
+        child.parent = self
         self._update_focus ()
+        self.invalidate_size ()
 
     def raise_child (self, child):
         if self.children[0] is child:
@@ -33,6 +41,7 @@ class Stack (Container):
         self.children.remove (child)
         self.children.insert (0, child)
         self._update_focus ()
+        self.invalidate ()
 
     def get_size (self):
         width = 0
@@ -44,11 +53,52 @@ class Stack (Container):
         return (width, height)
 
     def render (self, frame, theme):
+        self.render_children (frame, theme, True)
+
+    def render_children (self, frame, theme, force = False):
         self._update_focus ()
-        # FIXME: Work out if widgets would be covered and skip rendering
         # FIXME: Take colour out of covered children
-        have_cursor = False
-        for child in reversed (self.children):
+        (frame_x, frame_y, _, _) = frame.get_area ()
+        damage = frame.get_damage ()
+        damage_start = len (damage)
+        occluders = frame.get_occluders ()
+        n_occluders = len (occluders)
+
+        # Work out where each child will be drawn, from the top down
+        children = []
+        for child in self.children:
             if not child.visible:
                 continue
-            child.render_aligned (frame, theme)
+            (x, y, width, height) = child.get_aligned_area (frame.width, frame.height)
+            children.append ((child, (frame_x + x, frame_y + y, width, height)))
+
+        frame.cursor = None
+        for i in range (len (children) - 1, -1, -1):
+            (child, area) = children[i]
+
+            # Skip children that are completely covered, and don't draw in the parts that are covered
+            covering = []
+            for (c, a) in children[:i]:
+                if c.opaque and _overlaps (a, area):
+                    covering.append (a)
+            is_covered = False
+            for a in occluders + covering:
+                if _contains (a, area):
+                    is_covered = True
+                    break
+            if is_covered:
+                continue
+
+            # Render again if a child below drew over this one
+            child_force = force
+            if not child_force and not child.opaque:
+                for j in range (damage_start, len (damage)):
+                    if _overlaps (damage[j], area):
+                        child_force = True
+                        break
+
+            occluders.extend (covering)
+            child_frame = self.render_child (child, frame, 0, 0, frame.width, frame.height, theme, child_force)
+            del occluders[n_occluders:]
+            if child_frame.cursor is not None:
+                frame.cursor = child_frame.cursor
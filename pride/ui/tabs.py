@@ -13,13 +13,18 @@ class Tabs (Widget):
         Widget.__init__ (self)
         self.tabs = []
         self.selected = 0
+        self.opaque = True
         self.set_scale (1.0, 0.0)
 
     def add_child (self, label):
         self.tabs.append (label)
+        self.invalidate ()
 
     def set_selected (self, index):
+        if self.selected == index:
+            return
         self.selected = index
+        self.invalidate ()
 
     def get_size (self):
         return (0, 1)
@@ -0,0 +1,526 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import collections
+
+from . import unicodewidth
+
+_TAB_WIDTH = 8
+
+# Style of text that hasn't been changed, as (foreground, background, attributes).
+# Colors are '#RRGGBB' or None for the default, and attributes are the flags in Frame.
+DEFAULT_STYLE = (None, None, 0)
+
+# A line of cells, with the styles kept as runs of (start column, style)
+class _Line (list):
+    def __init__ (self, width, style = DEFAULT_STYLE):
+        list.__init__ (self, ' ' * width)
+        self.runs = [ (0, style) ]
+
+    def get_style (self, x):
+        for (start, style) in reversed (self.runs):
+            if start <= x:
+                return style
+        return DEFAULT_STYLE
+
+    # Use runs, joining the ones with the same style and dropping the ones after the end of the line
+    def _set_runs (self, runs):
+        self.runs = []
+        for (start, style) in runs:
+            if start >= len (self):
+                break
+            if len (self.runs) == 0 or style != self.runs[-1][1]:
+                self.runs.append ((start, style))
+
+    def set_style (self, start, end, style):
+        if start >= end or (len (self.runs) == 1 and self.runs[0][1] == style):
+            return
+        runs = [ run for run in self.runs if run[0] < start ]
+        runs.append ((start, style))
+        if end < len (self):
+            runs.append ((end, self.get_style (end)))
+        runs.extend ([ run for run in self.runs if run[0] > end ])
+        self._set_runs (runs)
+
+    # Insert blank cells at x, moving the cells after it to the right
+    def insert_blank (self, x, count, style):
+        width = len (self)
+        _split_wide (self, x, width - count)
+        self[x:x] = ' ' * count
+        del self[width:]
+        runs = [ run for run in self.runs if run[0] < x ]
+        runs.append ((x, style))
+        runs.append ((x + count, self.get_style (x)))
+        runs.extend ([ (start + count, s) for (start, s) in self.runs if start > x ])
+        self._set_runs (runs)
+
+    # Delete cells at x, moving the cells after it to the left and adding blank cells at the end
+    def delete (self, x, count, style):
+        width = len (self)
+        _split_wide (self, x, x + count)
+        del self[x:x + count]
+        self.extend (' ' * count)
+        runs = [ run for run in self.runs if run[0] < x ]
+        runs.append ((x, self.get_style (x + count)))
+        runs.extend ([ (start - count, s) for (start, s) in self.runs if start > x + count ])
+        runs.append ((width - count, style))
+        self._set_runs (runs)
+
+    def resize (self, width):
+        if width < len (self):
+            _split_wide (self, width, width)
+            del self[width:]
+            self._set_runs (self.runs)
+        else:
+            self.runs.append ((len (self), DEFAULT_STYLE))
+            self.extend (' ' * (width - len (self)))
+            self._set_runs (self.runs)
+
+    # Get the text in each run as (column, text, style)
+    def get_spans (self):
+        spans = []
+        for (i, (start, style)) in enumerate (self.runs):
+            end = self.runs[i + 1][0] if i + 1 < len (self.runs) else len (self)
+            spans.append ((start, ''.join (self[start:end]), style))
+        return spans
+
+# Get the spans of a line to keep in the scrollback, without the blank space at the end
+def _get_scrollback_spans (line):
+    spans = line.get_spans ()
+    (x, text, style) = spans[-1]
+    if style == DEFAULT_STYLE:
+        text = text.rstrip (' ')
+        if text == '':
+            spans.pop ()
+        else:
+            spans[-1] = (x, text, style)
+    return tuple (spans)
+
+# Replace the parts of wide characters that will be left when cells start to end are overwritten
+def _split_wide (line, start, end):
+    if start < len (line) and line[start] == '' and start > 0:
+        line[start - 1] = ' '
+    if end < len (line) and line[end] == '':
+        line[end] = ' '
+
+# The contents of a terminal, a grid of cells that programs write to.
+# Each cell contains a grapheme cluster, with the cell after a wide character
+# containing ''. Lines that scroll off the top of the screen are kept in a
+# limited scrollback as spans of (column, text, style).
+class TerminalScreen:
+    def __init__ (self, width = 80, height = 24, scrollback_size = 10000):
+        self.width = width
+        self.height = height
+        self.lines = [ _Line (width) for y in range (height) ]
+        self.scrollback = collections.deque (maxlen = scrollback_size)
+        self.cursor = (0, 0)
+        self.cursor_visible = True
+        # Style that text is written in
+        self.style = DEFAULT_STYLE
+        self.autowrap = True
+        # Set when a character is written in the last column, so the next one starts a new line
+        self.wrap_pending = False
+        # First and last lines that scroll
+        self.scroll_top = 0
+        self.scroll_bottom = height - 1
+        self.saved_cursor = (0, 0)
+        # Lines and cursor of the normal screen while the alternate screen is used
+        self.main_screen = None
+
+    def get_line (self, y):
+        return ''.join (self.lines[y])
+
+    # Get the text in line y as spans of (column, text, style)
+    def get_spans (self, y):
+        return self.lines[y].get_spans ()
+
+    # Style of cells that are erased, which keep the background color
+    def _get_blank_style (self):
+        return (None, self.style[1], 0)
+
+    def set_cursor (self, x, y):
+        self.cursor = (max (0, min (x, self.width - 1)), max (0, min (y, self.height - 1)))
+        self.wrap_pending = False
+
+    def write (self, text):
+        if text.isascii ():
+            self._write_ascii (text)
+            return
+        for cluster in unicodewidth.get_clusters (text):
+            width = unicodewidth.get_cluster_width (cluster)
+            (x, y) = self.cursor
+            line = self.lines[y]
+
+            # Join onto the last character written
+            last = x if self.wrap_pending else x - 1
+            if last >= 0 and line[last] == '':
+                last -= 1
+            if last >= 0 and not unicodewidth.is_boundary (line[last][-1], cluster[0]):
+                line[last] += cluster
+                continue
+
+            # Wide characters don't fit on a screen one column wide
+            if width > self.width:
+                cluster = ' '
+                width = 1
+
+            if self.wrap_pending or x + width > self.width:
+                if self.autowrap:
+                    if not self.wrap_pending:
+                        _split_wide (line, x, self.width)
+                        line[x:] = ' ' * (self.width - x)
+                    self.carriage_return ()
+                    self.line_feed ()
+                    (x, y) = self.cursor
+                    line = self.lines[y]
+                else:
+                    x = self.width - width
+            _split_wide (line, x, x + width)
+            line[x] = cluster
+            if width == 2:
+                line[x + 1] = ''
+            line.set_style (x, x + width, self.style)
+            self._advance (x + width)
+
+    def _write_ascii (self, text):
+        while text != '':
+            if self.wrap_pending and self.autowrap:
+                self.carriage_return ()
+                self.line_feed ()
+            (x, y) = self.cursor
+            if self.wrap_pending:
+                x = self.width - 1
+            line = self.lines[y]
+            if self.autowrap:
+                n = min (len (text), self.width - x)
+                data = text[:n]
+                text = text[n:]
+            else:
+                # Everything after the end of the line is written into the last column
+                n = min (len (text), self.width - x)
+                data = text[:n - 1] + text[-1]
+                text = ''
+            _split_wide (line, x, x + n)
+            line[x:x + n] = data
+            line.set_style (x, x + n, self.style)
+            self._advance (x + n)
+
+    # Move the cursor after a character that ends at column x
+    def _advance (self, x):
+        if x >= self.width:
+            self.cursor = (self.width - 1, self.cursor[1])
+            self.wrap_pending = True
+        else:
+            self.cursor = (x, self.cursor[1])
+            self.wrap_pending = False
+
+    def carriage_return (self):
+        self.set_cursor (0, self.cursor[1])
+
+    def line_feed (self):
+        (x, y) = self.cursor
+        if y == self.scroll_bottom:
+            self.scroll_up (1)
+        else:
+            self.set_cursor (x, y + 1)
+        self.wrap_pending = False
+
+    def reverse_line_feed (self):
+        (x, y) = self.cursor
+        if y == self.scroll_top:
+            self.scroll_down (1)
+        else:
+            self.set_cursor (x, y - 1)
+
+    def backspace (self):
+        (x, y) = self.cursor
+        self.set_cursor (x - 1, y)
+
+    def tab (self):
+        (x, y) = self.cursor
+        self.set_cursor ((x // _TAB_WIDTH + 1) * _TAB_WIDTH, y)
+
+    # Remove lines from top, moving the lines below up to the bottom of the scroll region
+    def _remove_lines (self, top, count):
+        count = min (count, self.scroll_bottom - top + 1)
+        removed = self.lines[top:top + count]
+        del self.lines[top:top + count]
+        self.lines[self.scroll_bottom + 1 - count:self.scroll_bottom + 1 - count] = [ _Line (self.width, self._get_blank_style ()) for i in range (count) ]
+        return removed
+
+    # Add blank lines at top, moving the lines below down to the bottom of the scroll region
+    def _add_lines (self, top, count):
+        count = min (count, self.scroll_bottom - top + 1)
+        del self.lines[self.scroll_bottom + 1 - count:self.scroll_bottom + 1]
+        self.lines[top:top] = [ _Line (self.width, self._get_blank_style ()) for i in range (count) ]
+
+    # Move lines in the scroll region up, adding blank lines at the bottom
+    def scroll_up (self, count):
+        removed = self._remove_lines (self.scroll_top, count)
+        if self.scroll_top == 0 and self.main_screen is None:
+            for line in removed:
+                self.scrollback.append (_get_scrollback_spans (line))
+
+    # Move lines in the scroll region down, adding blank lines at the top
+    def scroll_down (self, count):
+        self._add_lines (self.scroll_top, count)
+
+    # Set the lines that scroll, or the whole screen if bottom is None
+    def set_scroll_region (self, top, bottom = None):
+        if bottom is None:
+            bottom = self.height - 1
+        top = max (0, top)
+        bottom = min (bottom, self.height - 1)
+        if top >= bottom:
+            return
+        self.scroll_top = top
+        self.scroll_bottom = bottom
+        self.set_cursor (0, 0)
+
+    def _erase (self, y, start, end):
+        line = self.lines[y]
+        _split_wide (line, start, end)
+        line[start:end] = ' ' * (end - start)
+        line.set_style (start, end, self._get_blank_style ())
+
+    # Mode 0 erases from the cursor to the end of the screen, 1 from the start
+    # to the cursor, 2 all of it and 3 the scrollback
+    def erase_display (self, mode):
+        (x, y) = self.cursor
+        if mode == 0:
+            self._erase (y, x, self.width)
+            for i in range (y + 1, self.height):
+                self._erase (i, 0, self.width)
+        elif mode == 1:
+            for i in range (y):
+                self._erase (i, 0, self.width)
+            self._erase (y, 0, x + 1)
+        elif mode == 2:
+            for i in range (self.height):
+                self._erase (i, 0, self.width)
+        elif mode == 3:
+            self.scrollback.clear ()
+        self.wrap_pending = False
+
+    # Mode 0 erases from the cursor to the end of the line, 1 from the start
+    # to the cursor and 2 all of it
+    def erase_line (self, mode):
+        (x, y) = self.cursor
+        if mode == 0:
+            self._erase (y, x, self.width)
+        elif mode == 1:
+            self._erase (y, 0, x + 1)
+        elif mode == 2:
+            self._erase (y, 0, self.width)
+        self.wrap_pending = False
+
+    def erase_characters (self, count):
+        (x, y) = self.cursor
+        self._erase (y, x, min (x + count, self.width))
+        self.wrap_pending = False
+
+    def insert_characters (self, count):
+        (x, y) = self.cursor
+        count = min (count, self.width - x)
+        self.lines[y].insert_blank (x, count, self._get_blank_style ())
+        self.wrap_pending = False
+
+    def delete_characters (self, count):
+        (x, y) = self.cursor
+        count = min (count, self.width - x)
+        self.lines[y].delete (x, count, self._get_blank_style ())
+        self.wrap_pending = False
+
+    # Insert or delete lines at the cursor, moving the lines below in the scroll region
+    def insert_lines (self, count):
+        (x, y) = self.cursor
+        if y < self.scroll_top or y > self.scroll_bottom:
+            return
+        self._add_lines (y, count)
+        self.set_cursor (0, y)
+
+    def delete_lines (self, count):
+        (x, y) = self.cursor
+        if y < self.scroll_top or y > self.scroll_bottom:
+            return
+        self._remove_lines (y, count)
+        self.set_cursor (0, y)
+
+    def save_cursor (self):
+        self.saved_cursor = self.cursor
+
+    def restore_cursor (self):
+        self.set_cursor (*self.saved_cursor)
+
+    # Switch to a blank screen that programs like editors use, and back again
+    def set_alternate_screen (self, enabled):
+        if enabled == (self.main_screen is not None):
+            return
+        self.scroll_top = 0
+        self.scroll_bottom = self.height - 1
+        if enabled:
+            self.main_screen = (self.lines, self.cursor)
+            self.lines = [ _Line (self.width) for y in range (self.height) ]
+        else:
+            (self.lines, cursor) = self.main_screen
+            self.main_screen = None
+            self.set_cursor (*cursor)
+
+    def resize (self, width, height):
+        if (width, height) == (self.width, self.height):
+            return
+        (x, y) = self.cursor
+
+        # Move lines into the scrollback to keep the cursor on screen, and remove the rest from the bottom
+        if height < self.height:
+            n_scrolled = max (0, y - (height - 1))
+            if self.main_screen is None:
+                for line in self.lines[:n_scrolled]:
+                    self.scrollback.append (_get_scrollback_spans (line))
+            del self.lines[:n_scrolled]
+            del self.lines[height:]
+            y -= n_scrolled
+        self.lines.extend ([ _Line (self.width) for i in range (height - len (self.lines)) ])
+        if self.main_screen is not None:
+            (lines, cursor) = self.main_screen
+            del lines[height:]
+            lines.extend ([ _Line (self.width) for i in range (height - len (lines)) ])
+            self.main_screen = (lines, cursor)
+
+        for lines in (self.lines, self.main_screen[0] if self.main_screen is not None else []):
+            for line in lines:
+                line.resize (width)
+
+        self.width = width
+        self.height = height
+        self.scroll_top = 0
+        self.scroll_bottom = height - 1
+        self.set_cursor (x, y)
+
+if __name__ == '__main__':
+    def get_text (screen):
+        return [ screen.get_line (y).rstrip (' ') for y in range (screen.height) ]
+    def get_scrollback (screen):
+        return [ ''.join ([ text for (x, text, style) in spans ]) for spans in screen.scrollback ]
+
+    s = TerminalScreen (10, 3, scrollback_size = 2)
+    s.write ('Hello')
+    assert (s.cursor == (5, 0))
+    s.write ('World!')
+    assert (get_text (s) == ['HelloWorld', '!', ''])
+    s.write ('中文')
+    assert (s.cursor == (5, 1))
+    assert (s.lines[1][:5] == ['!', '中', '', '文', ''])
+    s.set_cursor (2, 1)
+    s.write ('x')
+    assert (get_text (s) == ['HelloWorld', '! x文', ''])
+    s.write ('e\u0301')
+    assert (s.lines[1][3] == 'e\u0301')
+
+    # Lines scroll into a limited scrollback
+    for i in range (4):
+        s.carriage_return ()
+        s.line_feed ()
+        s.write (str (i))
+    assert (get_text (s) == ['1', '2', '3'])
+    assert (get_scrollback (s) == ['! xe\u0301', '0'])
+
+    # Erasing
+    s.set_cursor (0, 1)
+    s.erase_display (0)
+    assert (get_text (s) == ['1', '', ''])
+    s.write ('abcdef')
+    s.set_cursor (2, 1)
+    s.erase_line (1)
+    assert (get_text (s) == ['1', '   def', ''])
+    s.erase_characters (2)
+    assert (get_text (s) == ['1', '    ef', ''])
+    s.delete_characters (1)
+    assert (get_text (s) == ['1', '   ef', ''])
+    s.insert_characters (2)
+    assert (get_text (s) == ['1', '     ef', ''])
+
+    # Scroll regions
+    s = TerminalScreen (10, 4)
+    for i in range (4):
+        s.set_cursor (0, i)
+        s.write (str (i))
+    s.set_scroll_region (1, 2)
+    s.set_cursor (0, 2)
+    s.line_feed ()
+    assert (get_text (s) == ['0', '2', '', '3'])
+    s.set_cursor (0, 1)
+    s.insert_lines (1)
+    assert (get_text (s) == ['0', '', '2', '3'])
+    s.delete_lines (1)
+    assert (get_text (s) == ['0', '2', '', '3'])
+    assert (len (s.scrollback) == 0)
+
+    # Alternate screen
+    s.set_cursor (1, 3)
+    s.set_alternate_screen (True)
+    s.set_cursor (0, 0)
+    s.write ('alt')
+    assert (get_text (s) == ['alt', '', '', ''])
+    s.set_alternate_screen (False)
+    assert (get_text (s) == ['0', '2', '', '3'])
+    assert (s.cursor == (1, 3))
+
+    # Resizing keeps the cursor on screen
+    s.set_cursor (1, 3)
+    s.resize (5, 2)
+    assert (get_text (s) == ['', '3'])
+    assert (s.cursor == (1, 1))
+    assert (get_scrollback (s) == ['0', '2'])
+    s.resize (6, 3)
+    assert (get_text (s) == ['', '3', ''])
+
+    # Wide characters at the end of the line
+    s = TerminalScreen (10, 2)
+    s.set_cursor (8, 0)
+    s.write ('中\u0301x')
+    assert (s.lines[0][8:] == ['中\u0301', ''])
+    s.set_cursor (9, 0)
+    s.write ('文')
+    assert (get_text (s) == ['', '文'])
+    s.resize (1, 3)
+    s.set_cursor (0, 0)
+    s.write ('中x')
+    assert (s.lines[0] == [' '] and s.lines[1] == ['x'])
+    s.autowrap = False
+    s.write ('文')
+    assert (s.lines[1] == [' '])
+
+    # Styles are kept as runs
+    red = ('#FF0000', None, 0)
+    blue = (None, '#0000FF', 0)
+    s = TerminalScreen (10, 2)
+    s.write ('a')
+    s.style = red
+    s.write ('bc')
+    s.style = DEFAULT_STYLE
+    s.write ('d')
+    assert (s.get_spans (0) == [ (0, 'a', DEFAULT_STYLE), (1, 'bc', red), (3, 'd      ', DEFAULT_STYLE) ])
+    s.set_cursor (2, 0)
+    s.insert_characters (2)
+    assert (s.get_spans (0) == [ (0, 'a', DEFAULT_STYLE), (1, 'b', red), (2, '  ', DEFAULT_STYLE), (4, 'c', red), (5, 'd    ', DEFAULT_STYLE) ])
+    s.delete_characters (3)
+    assert (s.get_spans (0) == [ (0, 'a', DEFAULT_STYLE), (1, 'b', red), (2, 'd       ', DEFAULT_STYLE) ])
+    s.style = blue
+    s.delete_characters (1)
+    assert (s.get_spans (0) == [ (0, 'a', DEFAULT_STYLE), (1, 'b', red), (2, '       ', DEFAULT_STYLE), (9, ' ', blue) ])
+
+    # Erasing keeps the background color
+    s.set_cursor (0, 0)
+    s.erase_characters (1)
+    assert (s.get_spans (0)[0] == (0, ' ', blue))
+    s.style = DEFAULT_STYLE
+    s.set_cursor (0, 1)
+    s.write ('x')
+    s.line_feed ()
+    assert (list (s.scrollback) == [ ((0, ' ', blue), (1, 'b', red), (2, '       ', DEFAULT_STYLE), (9, ' ', blue)) ])
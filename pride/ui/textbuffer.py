@@ -6,182 +6,346 @@
 # version. See http://www.gnu.org/copyleft/gpl.html the full text of the
 # license.
 
-import unicodedata
-
-def get_variation_selector (c):
-    if ord (c) >= 0xFE00 and ord (c) <= 0xFE0F:
-        return ord (c) - 0xFE00 + 1
-    else:
-        return 0
-
-def get_char_width (c):
-    if len (c) == 2 and get_variation_selector (c[1]) == 16: # Emoji
-        return 2
-    elif unicodedata.east_asian_width (c) in ('W', 'F'):
-        return 2
-    else:
-        return 1
-
-class unicode_iterator:
-    def __init__ (self, string):
-        self.string = string
-        self.index = 0
-
-    def __iter__ (self):
-        return self
-
-    def __next__ (self):
-        if self.index >= len (self.string):
-            raise StopIteration
-
-        c = self.string[self.index]
-
-        # Keep variation selectors and combining diacritics
-        if self.index + 1 < len (self.string):
-            c2 = self.string[self.index + 1]
-            if get_variation_selector (c2) != 0 or unicodedata.combining (c2) != 0:
-                c += c2
-                self.index += 1
-
-        self.index += 1
-        return c
-
-def get_line_width (line):
-    length = 0
-    for c in unicode_iterator (line):
-        length += get_char_width (c)
-    return length
-
-def _explode_line (line, width = 0):
-    exploded = []
-    for c in unicode_iterator (line):
-        exploded.append (c)
-        if get_char_width (c) == 2:
-            exploded.append (None)
-    while len (exploded) < width:
-        exploded.append (' ')
-    return exploded
-
-def _implode_line (line):
-    imploded = ''
-    for c in line:
-        if c != None:
-            imploded += c
-    return imploded
+import bisect
+
+from . import unicodewidth
+from .textchange import ChangeKind, TextChange
+
+# Check if offset in line is between two clusters
+def _is_boundary (line, offset):
+    return offset == 0 or offset >= len (line) or unicodewidth.is_boundary (line[offset - 1], line[offset])
+
+# Maps between display columns and string offsets in a line.
+# Only clusters that aren't a single character one column wide are stored, so ASCII lines have no entries.
+class _ColumnMap:
+    def __init__ (self, length, clusters):
+        self.length = length
+        # Clusters as (column, offset, width, length)
+        self.clusters = clusters
+        self.columns = [ cluster[0] for cluster in clusters ]
+        self.offsets = [ cluster[1] for cluster in clusters ]
+        self.width = length
+        for (_, _, width, cluster_length) in clusters:
+            self.width += width - cluster_length
+
+    # Get the cluster at column as (column, offset, width, length).
+    # Columns past the end of the line return a cluster of width zero.
+    def get_cluster (self, column):
+        i = bisect.bisect_right (self.columns, column) - 1
+        if i >= 0:
+            (cluster_column, cluster_offset, width, length) = self.clusters[i]
+            if column < cluster_column + width:
+                return self.clusters[i]
+            offset = cluster_offset + length + column - (cluster_column + width)
+        else:
+            offset = column
+        if offset >= self.length:
+            return (column, offset, 0, 0)
+        return (column, offset, 1, 1)
+
+    # Get the column that the cluster at offset starts at
+    def get_column (self, offset):
+        i = bisect.bisect_right (self.offsets, offset) - 1
+        if i < 0:
+            return offset
+        (cluster_column, cluster_offset, width, length) = self.clusters[i]
+        if offset < cluster_offset + length:
+            return cluster_column
+        return cluster_column + width + offset - (cluster_offset + length)
+
+    # Get the map for this line with the characters between start and end replaced with text
+    def splice (self, start, end, text_map):
+        start_column = self.get_column (start)
+        column_change = text_map.width - (self.get_column (end) - start_column)
+        offset_change = text_map.length - (end - start)
+        i = bisect.bisect_left (self.offsets, start)
+        j = bisect.bisect_left (self.offsets, end)
+        clusters = self.clusters[:i]
+        for (column, offset, width, length) in text_map.clusters:
+            clusters.append ((column + start_column, offset + start, width, length))
+        for (column, offset, width, length) in self.clusters[j:]:
+            clusters.append ((column + column_change, offset + offset_change, width, length))
+        return _ColumnMap (self.length + offset_change, clusters)
+
+def _make_column_map (line):
+    if line.isascii ():
+        return _ColumnMap (len (line), [])
+    clusters = []
+    column = 0
+    offset = 0
+    for c in unicodewidth.get_clusters (line):
+        width = unicodewidth.get_cluster_width (c)
+        if width != 1 or len (c) != 1:
+            clusters.append ((column, offset, width, len (c)))
+        column += width
+        offset += len (c)
+    return _ColumnMap (len (line), clusters)
+
+# Make a TextBuffer method notify all its changes at once, and report it to
+# the operation callbacks if it changed anything
+def _user_action (method):
+    def wrapper (self, *args, **kwargs):
+        version = self.version
+        self.begin_user_action ()
+        try:
+            result = method (self, *args, **kwargs)
+        finally:
+            self.end_user_action ()
+        if self.version != version:
+            for callback in self.operation_callbacks:
+                callback (method.__name__, args, kwargs)
+        return result
+    return wrapper
+
+# Maximum number of column maps to keep for lines that aren't ASCII
+_MAX_COLUMN_MAPS = 1024
 
 class TextBuffer:
-    def __init__ (self, changed_callback = None):
-        self.changed_callback = changed_callback
-        self.lines = []
+    # storage is the type used to store lines, it must behave like a list
+    def __init__ (self, changed_callback = None, storage = list):
+        self.changed_callbacks = []
+        if changed_callback is not None:
+            self.changed_callbacks.append (changed_callback)
+        self.operation_callbacks = []
+        self.storage = storage
+        self.lines = storage ()
+        self._column_maps = {}
+        self._user_action_depth = 0
+        self._pending_change = None
+        # Increased each time the text changes
+        self.version = 0
+
+    # Call callback with a TextChange when the text is changed
+    def add_changed_callback (self, callback):
+        self.changed_callbacks.append (callback)
+
+    # Call callback with the name and arguments of each operation that changes the text,
+    # so it can be repeated on another buffer
+    def add_operation_callback (self, callback):
+        self.operation_callbacks.append (callback)
+
+    # Group changes until end_user_action so they cause one notification, can be nested
+    def begin_user_action (self):
+        self._user_action_depth += 1
+
+    def end_user_action (self):
+        self._user_action_depth -= 1
+        if self._user_action_depth > 0 or self._pending_change is None:
+            return
+        change = self._pending_change
+        self._pending_change = None
+        change.end = min (change.end, len (self.lines))
+        for callback in self.changed_callbacks:
+            callback (change)
+
+    # Notify listeners of a change, needed if lines are modified directly
+    def notify_changed (self, change):
+        self.version += 1
+        if self._pending_change is None:
+            self._pending_change = change
+        else:
+            self._pending_change = self._pending_change.merge (change)
+        if self._user_action_depth == 0:
+            self.begin_user_action ()
+            self.end_user_action ()
 
     def clear (self):
-        self.lines = []
+        n_lines = len (self.lines)
+        self.lines = self.storage ()
+        if n_lines > 0:
+            self.notify_changed (TextChange (ChangeKind.ALL, 0, 0, -n_lines))
+
+    def _get_column_map (self, line):
+        if line.isascii ():
+            return _ColumnMap (len (line), [])
+        column_map = self._column_maps.get (line)
+        if column_map is None:
+            column_map = _make_column_map (line)
+            self._add_column_map (line, column_map)
+        return column_map
+
+    def _add_column_map (self, line, column_map):
+        if line.isascii ():
+            return
+        if len (self._column_maps) >= _MAX_COLUMN_MAPS:
+            self._column_maps.clear ()
+        self._column_maps[line] = column_map
+
+    def get_line_width (self, y):
+        if y >= len (self.lines):
+            return 0
+        return self._get_column_map (self.lines[y]).width
+
+    # Get the column that the character at offset in line y is drawn at
+    def get_column (self, y, offset):
+        return self._get_column_map (self.lines[y]).get_column (offset)
+
+    # Get the offset in line y of the character drawn at column x
+    def get_offset (self, y, x):
+        (_, offset, _, _) = self._get_column_map (self.lines[y]).get_cluster (x)
+        return min (offset, len (self.lines[y]))
 
     def position_left (self, x, y):
         if y >= len (self.lines):
             return x
         if x <= 0:
             return 0
-        last_position = 0
-        p = 0
-        for c in unicode_iterator (self.lines[y]):
-            p += get_char_width (c)
-            if p >= x:
-                break
-            last_position = p
-        return last_position
+        column_map = self._get_column_map (self.lines[y])
+        if x > column_map.width:
+            return column_map.width
+        (column, _, _, _) = column_map.get_cluster (x - 1)
+        return column
 
     def position_right (self, x, y):
         if y >= len (self.lines):
             return x
-        if x >= get_line_width (self.lines[y]):
+        column_map = self._get_column_map (self.lines[y])
+        if x >= column_map.width:
             return x
-        last_position = 0
-        p = 0
-        for c in unicode_iterator (self.lines[y]):
-            p += get_char_width (c)
-            if last_position >= x:
-                break
-            last_position = p
-        return p
+        (column, _, width, _) = column_map.get_cluster (x)
+        # If inside a double width character move to the end of the next character
+        if column < x:
+            if column + width >= column_map.width:
+                return column_map.width
+            (column, _, width, _) = column_map.get_cluster (column + width)
+        return column + width
 
     # Ensure lines exists to requested position
     def _ensure_line (self, y):
+        n_lines = len (self.lines)
         while len (self.lines) <= y:
             self.lines.append ('')
+        if len (self.lines) > n_lines:
+            self.notify_changed (TextChange (ChangeKind.LINES, n_lines, len (self.lines), len (self.lines) - n_lines))
 
     def _update_line (self, y, line):
         if self.lines[y] == line:
             return
         self.lines[y] = line
-        if self.changed_callback is not None:
-            self.changed_callback ()
+        self.notify_changed (TextChange (ChangeKind.TEXT, y, y + 1))
+
+    # Replace the characters between offsets start and end in line y with text
+    def _replace (self, y, start, end, text):
+        line = self.lines[y]
+        new_line = line[:start] + text + line[end:]
+        if not new_line.isascii () and not (_is_boundary (line, start) and _is_boundary (line, end) and _is_boundary (new_line, start) and _is_boundary (new_line, start + len (text))):
+            # Characters will join differently so work it out again
+            self._get_column_map (new_line)
+        elif not new_line.isascii ():
+            # ASCII lines don't need a column map
+            column_map = self._get_column_map (line).splice (start, end, self._get_column_map (text))
+            self._add_column_map (new_line, column_map)
+        self._update_line (y, new_line)
+
+    # Replace the characters between offsets start and end in line y with text
+    @_user_action
+    def replace_text (self, y, start, end, text):
+        self._ensure_line (y)
+        self._replace (y, start, end, text)
 
+    @_user_action
     def insert (self, x, y, text, append_double_width = True):
         self._ensure_line (y)
-        exploded = _explode_line (self.lines[y], x)
-        step = get_line_width (text)
+        line = self.lines[y]
+        column_map = self._get_column_map (line)
+        step = self._get_column_map (text).width
+        if x >= column_map.width:
+            self._replace (y, len (line), len (line), ' ' * (x - column_map.width) + text)
+            return step
+        (column, offset, width, length) = column_map.get_cluster (x)
         # If inside a double width, move to next position or replace double with a space
-        if x < len (exploded) and exploded[x] == None:
+        if column < x:
             if append_double_width:
                 step += 1
-                exploded.insert (x + 1, text)
+                self._replace (y, offset + length, offset + length, text)
             else:
-                exploded.pop (x - 1)
-                exploded.insert (x, ' ')
-                exploded.insert (x + 1, text)
+                self._replace (y, offset, offset + length, ' ' + text)
         else:
-            exploded.insert (x, text)
-        self._update_line (y, _implode_line (exploded))
+            self._replace (y, offset, offset, text)
         return step
 
+    @_user_action
     def overwrite (self, x, y, text):
-        exploded_text = _explode_line (text)
         self._ensure_line (y)
-        exploded = _explode_line (self.lines[y], x + len (exploded_text))
-        # If start inside double width insert space
-        if x < len (exploded) and exploded[x] == None:
-            exploded = exploded[:x - 1] + ' ' + exploded_text + exploded[x + len (exploded_text):]
+        line = self.lines[y]
+        column_map = self._get_column_map (line)
+        if x >= column_map.width:
+            self._replace (y, len (line), len (line), ' ' * (x - column_map.width) + text)
+            return
+        # If start inside double width replace it with a space
+        (column, start, _, _) = column_map.get_cluster (x)
+        if column < x:
+            text = ' ' + text
+        # If end inside double width replace the remainder with a space
+        end_x = x + self._get_column_map (text).width
+        if column < x:
+            end_x -= 1
+        if end_x >= column_map.width:
+            end = len (line)
         else:
-            exploded = exploded[:x] + exploded_text + exploded[x + get_line_width (exploded_text):]
-        self._update_line (y, _implode_line (exploded))
+            (column, end, width, length) = column_map.get_cluster (end_x)
+            if column < end_x:
+                text += ' '
+                end += length
+        self._replace (y, start, end, text)
 
+    @_user_action
     def split_line (self, x, y):
         self._ensure_line (y)
-        exploded = _explode_line (self.lines[y], x)
-        self._update_line (y, _implode_line (exploded[:x]))
-        self.lines.insert (y + 1, _implode_line (exploded[x:]))
-
+        line = self.lines[y]
+        column_map = self._get_column_map (line)
+        if x >= column_map.width:
+            (first, second) = (line + ' ' * (x - column_map.width), '')
+        else:
+            (column, offset, _, length) = column_map.get_cluster (x)
+            # Keep a double width character on the first line
+            if column < x:
+                offset += length
+            (first, second) = (line[:offset], line[offset:])
+            empty_map = _ColumnMap (0, [])
+            self._add_column_map (first, column_map.splice (offset, len (line), empty_map))
+            self._add_column_map (second, column_map.splice (0, offset, empty_map))
+        self.lines[y] = first
+        self.lines.insert (y + 1, second)
+        self.notify_changed (TextChange (ChangeKind.LINES, y, y + 2, 1))
+
+    @_user_action
     def merge_lines (self, y):
         if y + 1 >= len (self.lines):
             return
-        self._update_line (y, self.lines[y] + self.lines[y + 1])
+        line = self.lines[y]
+        self._replace (y, len (line), len (line), self.lines[y + 1])
         self.lines.pop (y + 1)
+        self.notify_changed (TextChange (ChangeKind.LINES, y, y + 1, -1))
 
+    @_user_action
     def delete_left (self, x, y):
         if x == 0:
             return 0
         self._ensure_line (y)
-        exploded = _explode_line (self.lines[y], x)
-        # If deleting a double width character then delete two spaces
-        if exploded[x - 1] == None:
-            exploded.pop (x - 2)
-            step = -2
+        line = self.lines[y]
+        column_map = self._get_column_map (line)
+        if x > column_map.width:
+            self._replace (y, len (line), len (line), ' ' * (x - column_map.width - 1))
+            return -1
+        (column, offset, _, length) = column_map.get_cluster (x - 1)
+        self._replace (y, offset, offset + length, '')
+        # If deleting a double width character then move back two spaces
+        if column < x - 1:
+            return -2
         else:
-            exploded.pop (x - 1)
-            step = -1
-        self._update_line (y, _implode_line (exploded))
-        return step
+            return -1
 
+    @_user_action
     def delete_right (self, x, y):
         self._ensure_line (y)
-        exploded = _explode_line (self.lines[y], x)
+        line = self.lines[y]
+        column_map = self._get_column_map (line)
+        if x >= column_map.width:
+            return 0
         # If inside double width delete that character
-        if x < len (exploded) and exploded[x] == None:
-            exploded.pop (x - 1)
-        else:
-            exploded.pop (x)
-        self._update_line (y, _implode_line (exploded))
+        (_, offset, _, length) = column_map.get_cluster (x)
+        self._replace (y, offset, offset + length, '')
         return 0
 
 if __name__ == '__main__':
@@ -258,3 +422,41 @@ if __name__ == '__main__':
     # Merge lines
     b.merge_lines (0)
     assert (b.lines == ['1234'])
+
+    # Double width characters
+    b.clear ()
+    b.insert (0, 0, 'A中B')
+    assert (b.get_line_width (0) == 4)
+    assert (b.position_right (1, 0) == 3)
+    assert (b.position_left (3, 0) == 1)
+    assert (b.insert (2, 0, 'C') == 2)
+    assert (b.lines == ['A中CB'])
+    b.overwrite (2, 0, 'D')
+    assert (b.lines == ['A DCB'])
+    b.split_line (1, 0)
+    assert (b.lines == ['A', ' DCB'])
+    b.merge_lines (0)
+    b.overwrite (0, 0, '中')
+    assert (b.lines == ['中DCB'])
+    assert (b.delete_left (2, 0) == -2)
+    assert (b.lines == ['DCB'])
+
+    # Change notifications
+    changes = []
+    b = TextBuffer (changed_callback = lambda change: changes.append ((change.kind, change.start, change.end, change.line_delta)))
+    b.insert (0, 1, 'AB')
+    assert (changes == [('lines', 0, 2, 2)])
+    changes.clear ()
+    b.split_line (1, 1)
+    assert (changes == [('lines', 1, 3, 1)])
+    changes.clear ()
+    b.begin_user_action ()
+    b.insert (0, 0, '1')
+    b.insert (0, 2, '2')
+    assert (changes == [])
+    b.end_user_action ()
+    assert (changes == [('text', 0, 3, 0)])
+    changes.clear ()
+    b.merge_lines (1)
+    assert (b.lines == ['1', 'A2B'])
+    assert (changes == [('lines', 1, 2, -1)])
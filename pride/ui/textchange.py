@@ -0,0 +1,36 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+class ChangeKind:
+    TEXT  = 'text'  # Text changed within lines
+    LINES = 'lines' # Lines were added or removed
+    ALL   = 'all'   # All lines were replaced
+
+_KIND_ORDER = [ ChangeKind.TEXT, ChangeKind.LINES, ChangeKind.ALL ]
+
+# A change to lines start to end (after the change) in a TextBuffer.
+# line_delta is the number of lines added (or removed if negative), lines after end have moved by this amount.
+class TextChange:
+    def __init__ (self, kind, start, end, line_delta = 0):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.line_delta = line_delta
+
+    # Get a change that covers this change followed by another
+    def merge (self, change):
+        kind = max (self.kind, change.kind, key = _KIND_ORDER.index)
+        end = self.end
+        if end > change.start:
+            end = max (end + change.line_delta, change.start)
+        start = min (self.start, change.start)
+        end = max (end, change.end)
+        return TextChange (kind, start, end, self.line_delta + change.line_delta)
+
+    def __str__ (self):
+        return 'TextChange({}, {}, {}, {})'.format (self.kind, self.start, self.end, self.line_delta)
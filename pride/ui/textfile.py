@@ -0,0 +1,182 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import codecs
+import hashlib
+import itertools
+import os
+import tempfile
+
+# Number of lines to encode at once
+_BATCH_SIZE = 1024
+
+# Number of bytes to decode at once
+_READ_SIZE = 1024 * 1024
+
+# Encodings with a byte order mark
+_BOMS = [ (codecs.BOM_UTF8, 'utf-8-sig'),
+          (codecs.BOM_UTF16_LE, 'utf-16-le'),
+          (codecs.BOM_UTF16_BE, 'utf-16-be') ]
+
+# Get the byte order mark that is skipped when reading and added when writing.
+# The utf-8-sig codec does this itself, but the utf-16 codec always writes the
+# native byte order so the UTF-16 files use codecs without a byte order mark.
+def _get_bom (encoding):
+    if encoding == 'utf-16-le':
+        return codecs.BOM_UTF16_LE
+    elif encoding == 'utf-16-be':
+        return codecs.BOM_UTF16_BE
+    else:
+        return b''
+
+# Invalid bytes are kept as surrogates so they are written back unchanged
+def _get_errors (encoding):
+    if encoding.startswith ('utf-16'):
+        return 'strict'
+    return 'surrogateescape'
+
+# Guess the encoding and newline style of a file from its first bytes, returns (encoding, newline)
+def detect_format (data):
+    encoding = None
+    for (bom, bom_encoding) in _BOMS:
+        if data.startswith (bom):
+            encoding = bom_encoding
+            break
+    if encoding is None:
+        # Files that aren't UTF-8 are most likely in a legacy 8 bit encoding
+        try:
+            codecs.getincrementaldecoder ('utf-8') ().decode (data)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'latin-1'
+
+    text = codecs.getincrementaldecoder (encoding) (errors = 'replace').decode (data[len (_get_bom (encoding)):])
+    newline = '\n'
+    for (i, c) in enumerate (text):
+        if c == '\n':
+            break
+        if c == '\r':
+            if i + 1 < len (text) and text[i + 1] == '\n':
+                newline = '\r\n'
+            elif i + 1 < len (text):
+                newline = '\r'
+            break
+    return (encoding, newline)
+
+# Read the lines of the file at path into lines, decoding it in blocks.
+# Returns the (encoding, newline) the file uses.
+def read_lines (path, lines):
+    f = open (path, 'rb')
+    data = f.read (_READ_SIZE)
+    (encoding, newline) = detect_format (data)
+    data = data[len (_get_bom (encoding)):]
+    decoder = codecs.getincrementaldecoder (encoding) (errors = _get_errors (encoding))
+    partial = ''
+    while True:
+        final = len (data) == 0
+        text = partial + decoder.decode (data, final)
+        new_lines = text.split (newline)
+        if final:
+            lines.extend (new_lines)
+            break
+        partial = new_lines.pop ()
+        lines.extend (new_lines)
+        data = f.read (_READ_SIZE)
+    f.close ()
+    return (encoding, newline)
+
+# Get the contents of lines in encoded blocks
+def _get_blocks (lines, encoding, newline):
+    encoder = codecs.getincrementalencoder (encoding) (errors = _get_errors (encoding))
+    iterator = iter (lines)
+    prefix = _get_bom (encoding)
+    separator = ''
+    while True:
+        batch = list (itertools.islice (iterator, _BATCH_SIZE))
+        if len (batch) == 0:
+            return
+        yield prefix + encoder.encode (separator + newline.join (batch))
+        prefix = b''
+        separator = newline
+
+def _get_umask ():
+    umask = os.umask (0)
+    os.umask (umask)
+    return umask
+
+# Get a hash of the file contents lines would be written as
+def get_lines_hash (lines, encoding = 'utf-8', newline = '\n'):
+    h = hashlib.sha256 ()
+    for block in _get_blocks (lines, encoding, newline):
+        h.update (block)
+    return h.digest ()
+
+# Write lines to path. They are written to a temporary file which replaces path
+# once it is safely on disk, so path always contains either the old or new contents.
+def write_lines (path, lines, encoding = 'utf-8', newline = '\n'):
+    directory = os.path.dirname (os.path.abspath (path))
+    (fd, temporary_path) = tempfile.mkstemp (dir = directory, prefix = '.' + os.path.basename (path) + '.')
+    try:
+        with os.fdopen (fd, 'wb') as f:
+            for block in _get_blocks (lines, encoding, newline):
+                f.write (block)
+            f.flush ()
+            os.fsync (f.fileno ())
+        try:
+            mode = os.stat (path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_get_umask ()
+        os.chmod (temporary_path, mode)
+        os.replace (temporary_path, path)
+    except:
+        os.remove (temporary_path)
+        raise
+
+    # Make sure the rename is on disk
+    fd = os.open (directory, os.O_RDONLY)
+    try:
+        os.fsync (fd)
+    finally:
+        os.close (fd)
+
+if __name__ == '__main__':
+    def get_contents (lines, encoding = 'utf-8', newline = '\n'):
+        return b''.join (_get_blocks (lines, encoding, newline))
+    assert (get_contents ([]) == b'')
+    assert (get_contents (['A']) == b'A')
+    assert (get_contents (['A', '', 'B']) == b'A\n\nB')
+    assert (get_contents ([ str (i) for i in range (3000) ]) == '\n'.join ([ str (i) for i in range (3000) ]).encode ())
+    assert (get_lines_hash (['A', 'B']) == hashlib.sha256 (b'A\nB').digest ())
+
+    assert (detect_format (b'A\nB') == ('utf-8', '\n'))
+    assert (detect_format (b'A\r\nB') == ('utf-8', '\r\n'))
+    assert (detect_format (b'A\rB') == ('utf-8', '\r'))
+    assert (detect_format ('\ufeffé\r\n'.encode ('utf-8')) == ('utf-8-sig', '\r\n'))
+    assert (detect_format ('é\n'.encode ('latin-1')) == ('latin-1', '\n'))
+    assert (detect_format (codecs.BOM_UTF16_LE + 'A\r\n'.encode ('utf-16-le')) == ('utf-16-le', '\r\n'))
+    assert (detect_format (codecs.BOM_UTF16_BE + 'A\r\n'.encode ('utf-16-be')) == ('utf-16-be', '\r\n'))
+
+    # Files are written back as they were read
+    (fd, path) = tempfile.mkstemp ()
+    os.close (fd)
+    for (data, encoding, newline) in [ (b'', 'utf-8', '\n'),
+                                       (b'A\nB\n', 'utf-8', '\n'),
+                                       (b'A\r\nB\xff\r\n', 'latin-1', '\r\n'),
+                                       (b'A' * _READ_SIZE + b'\n\xff', 'utf-8', '\n'),
+                                       ('\ufeffA\r\nB'.encode ('utf-8'), 'utf-8-sig', '\r\n'),
+                                       ('é\nß'.encode ('latin-1'), 'latin-1', '\n'),
+                                       (codecs.BOM_UTF16_LE + 'A\r\n中'.encode ('utf-16-le'), 'utf-16-le', '\r\n'),
+                                       (codecs.BOM_UTF16_BE + 'A\nB'.encode ('utf-16-be'), 'utf-16-be', '\n'),
+                                       (b'A\rB\r' * 1000000, 'utf-8', '\r') ]:
+        open (path, 'wb').write (data)
+        lines = []
+        assert (read_lines (path, lines) == (encoding, newline))
+        assert (get_contents (lines, encoding, newline) == data)
+        write_lines (path, lines, encoding, newline)
+        assert (open (path, 'rb').read () == data)
+    os.remove (path)
@@ -7,24 +7,51 @@
 # license.
 
 from .keyinputevent import Key
+from .textchange import ChangeKind
 from .widget import Widget
-from .textbuffer import get_line_width
 
 class TextView (Widget):
-    def __init__ (self, buffer):
+    def __init__ (self, buffer, scrolled_callback = None):
         Widget.__init__ (self)
         self.buffer = buffer
+        self.scrolled_callback = scrolled_callback
         self.cursor = (0, 0)
         self.start_line = 0
+        self.n_visible_lines = 0
+        self.highlighter = None
+        self.search_index = None
+        self.opaque = True
         self.set_scale (1.0, 1.0)
+        buffer.add_changed_callback (self._buffer_changed)
+
+    # Set an object that provides get_spans (y) to color the text
+    def set_highlighter (self, highlighter):
+        self.highlighter = highlighter
+        self.invalidate ()
+
+    # Set a SearchIndex to show the matches of
+    def set_search_index (self, search_index):
+        self.search_index = search_index
+        self.invalidate ()
+
+    def set_cursor (self, line, column):
+        self.cursor = (line, column)
+        self.invalidate ()
+
+    def _buffer_changed (self, change):
+        # Changes to text that is scrolled out of view don't need a redraw,
+        # unless they are above it and might change the highlighting
+        if change.kind == ChangeKind.TEXT and change.start >= self.start_line + self.n_visible_lines:
+            return
+        if change.kind == ChangeKind.TEXT and change.end <= self.start_line and self.highlighter is None:
+            return
+        self.invalidate ()
 
     def get_size (self):
         return (1, 1)
 
     def get_current_line_width (self):
-        if len (self.buffer.lines) == 0:
-            return 0
-        return get_line_width (self.buffer.lines[self.cursor[0]])
+        return self.buffer.get_line_width (self.cursor[0])
 
     def anchor_cursor (self):
         self.cursor = (self.cursor[0], min (self.cursor[1], self.get_current_line_width ()))
@@ -43,7 +70,7 @@ class TextView (Widget):
         self.anchor_cursor ();
         if self.cursor[1] == 0:
             if self.cursor[0] > 0:
-                self.cursor = (self.cursor[0] - 1, len (self.buffer.lines[self.cursor[0] - 1]))
+                self.cursor = (self.cursor[0] - 1, self.buffer.get_line_width (self.cursor[0] - 1))
                 self.buffer.merge_lines (self.cursor[0])
         else:
             step = self.buffer.delete_left (self.cursor[1], self.cursor[0])
@@ -65,14 +92,16 @@ class TextView (Widget):
         if not self.buffer.lines[self.cursor[0]].startswith ('    '):
             # FIXME: Notify user of error
             return
+        self.buffer.begin_user_action ()
         for i in range (4):
             step = self.buffer.delete_right (0, self.cursor[0])
             self.cursor = (self.cursor[0], self.cursor[1] + step)
+        self.buffer.end_user_action ()
 
     def left (self):
         self.anchor_cursor ();
         if self.cursor[1] == 0 and self.cursor[0] > 0:
-            self.cursor = (self.cursor[0] - 1, get_line_width (self.buffer.lines[self.cursor[0] - 1]))
+            self.cursor = (self.cursor[0] - 1, self.buffer.get_line_width (self.cursor[0] - 1))
         else:
             self.cursor = (self.cursor[0], self.buffer.position_left (self.cursor[1], self.cursor[0]))
 
@@ -107,7 +136,7 @@ class TextView (Widget):
         if len (self.buffer.lines) == 0:
             self.cursor = (0, 0)
         else:
-            self.cursor = (max (len (self.buffer.lines) - 1, 0), get_line_width (self.buffer.lines[-1]))
+            self.cursor = (max (len (self.buffer.lines) - 1, 0), self.buffer.get_line_width (len (self.buffer.lines) - 1))
 
     def get_line_number_column_width (self):
         return len ('%d' % len (self.buffer.lines)) + 1
@@ -119,17 +148,34 @@ class TextView (Widget):
         while self.cursor[0] - self.start_line >= frame.height:
             self.start_line += 1
 
+        self.n_visible_lines = frame.height
+
         frame.clear (color = theme.text_background)
         line_number_column_width = self.get_line_number_column_width ()
         for y in range (self.start_line, min (len (self.buffer.lines), frame.height + self.start_line)):
             line_number = '%d' % (y + 1)
             frame.render_text (line_number_column_width - len (line_number) - 1, y - self.start_line, line_number, foreground = theme.line_number_color, background = theme.text_background)
             frame.render_text (line_number_column_width, y - self.start_line, self.buffer.lines[y], foreground = theme.text_color, background = theme.text_background)
+            if self.highlighter is not None:
+                line = self.buffer.lines[y]
+                for (start, end, style) in self.highlighter.get_spans (y):
+                    x = line_number_column_width + self.buffer.get_column (y, start)
+                    frame.render_text (x, y - self.start_line, line[start:end], foreground = getattr (theme, style + '_color'))
+            if self.search_index is not None:
+                line = self.buffer.lines[y]
+                length = len (self.search_index.query)
+                for start in self.search_index.get_matches (y):
+                    x = line_number_column_width + self.buffer.get_column (y, start)
+                    frame.render_text (x, y - self.start_line, line[start:start + length], background = theme.search_background)
 
         frame.cursor = (min (self.cursor[1], self.get_current_line_width ()) + self.get_line_number_column_width (), self.cursor[0] - self.start_line)
 
+        if self.scrolled_callback is not None:
+            self.scrolled_callback (self.start_line, frame.height)
+
     def handle_character_event (self, event):
         self.insert (chr (event.character))
+        self.invalidate ()
         return True
 
     def handle_key_event (self, event):
@@ -165,3 +211,5 @@ class TextView (Widget):
             self.document_end ()
         else:
             open ('debug.log', 'a').write ('Unhandled editor key {}\n'.format (event.key))
+
+        self.invalidate ()
@@ -19,3 +19,11 @@ class Theme:
         self.box_border          = '#0000FF'
         self.box_background      = '#000000'
         self.border_color        = '#FFFFFF'
+        self.keyword_color       = '#FFFF00'
+        self.builtin_color       = '#00FFFF'
+        self.definition_color    = '#00FF00'
+        self.decorator_color     = '#FF00FF'
+        self.string_color        = '#FF8000'
+        self.number_color        = '#FF8000'
+        self.comment_color       = '#808080'
+        self.search_background   = '#806000'
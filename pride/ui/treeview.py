@@ -37,6 +37,7 @@ class TreeView (Widget):
         else:
             return False
 
+        self.invalidate ()
         return True
 
     def render (self, frame, theme):
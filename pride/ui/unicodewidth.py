@@ -0,0 +1,138 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import bisect
+import unicodedata
+
+# Classes of characters
+_NARROW = 0
+_WIDE = 1    # Two columns wide
+_EXTEND = 2  # Joined onto the previous character
+
+_ZWJ = '\u200D'
+_VARIATION_SELECTOR_16 = '\uFE0F' # Emoji form
+
+# Only the first four planes contain wide characters
+_LAST_SCANNED = 0x3FFFF
+
+def _get_class (code):
+    if code == 0x200D or 0x1F3FB <= code <= 0x1F3FF or 0xE0020 <= code <= 0xE007F: # Joiner, skin tones and tags
+        return _EXTEND
+    if 0x1160 <= code <= 0x11FF: # Hangul vowels and final consonants
+        return _EXTEND
+    c = chr (code)
+    if unicodedata.category (c) in ('Mn', 'Me'): # Includes variation selectors
+        return _EXTEND
+    if unicodedata.east_asian_width (c) in ('W', 'F'):
+        return _WIDE
+    return _NARROW
+
+# Ranges of characters in the same class, as the start of each range and its class
+def _make_ranges ():
+    starts = []
+    classes = []
+    def add (code, c):
+        if len (classes) == 0 or c != classes[-1]:
+            starts.append (code)
+            classes.append (c)
+    for code in range (_LAST_SCANNED + 1):
+        add (code, _get_class (code))
+    add (_LAST_SCANNED + 1, _NARROW)
+    for code in range (0xE0000, 0xE01F0): # Tags and variation selectors
+        add (code, _get_class (code))
+    add (0xE01F0, _NARROW)
+    return (starts, classes)
+
+(_range_starts, _range_classes) = _make_ranges ()
+
+def _get_character_class (c):
+    return _range_classes[bisect.bisect_right (_range_starts, ord (c)) - 1]
+
+def _is_regional_indicator (c):
+    return '\U0001F1E6' <= c <= '\U0001F1FF'
+
+# Approximation of the emoji that can follow a zero width joiner
+def _is_pictographic (c):
+    return '\u2194' <= c <= '\u2BFF' or '\U0001F000' <= c <= '\U0001FAFF'
+
+# Check if there is a cluster boundary between characters a and b.
+# Pairs of regional indicators (flags) depend on the characters before them, so
+# this is False for all of them.
+def is_boundary (a, b):
+    if a < '\u0300' and b < '\u0300':
+        return True
+    if _get_character_class (b) == _EXTEND:
+        return False
+    if a == _ZWJ and _is_pictographic (b):
+        return False
+    if _is_regional_indicator (a) and _is_regional_indicator (b):
+        return False
+    return True
+
+# Split text into grapheme clusters, i.e. what are shown as one character.
+# This is a simplified version of http://www.unicode.org/reports/tr29/
+def get_clusters (text):
+    if text.isascii ():
+        return text
+    clusters = []
+    cluster = ''
+    for c in text:
+        if cluster != '' and is_boundary (cluster[-1], c):
+            clusters.append (cluster)
+            cluster = ''
+        # Flags are two regional indicators, the third starts a new flag
+        elif cluster != '' and _is_regional_indicator (c) and len (cluster) == 2 and _is_regional_indicator (cluster[0]):
+            clusters.append (cluster)
+            cluster = ''
+        cluster += c
+    if cluster != '':
+        clusters.append (cluster)
+    return clusters
+
+# Get the number of columns a cluster takes up
+def get_cluster_width (cluster):
+    if cluster < '\u1100':
+        return 1
+    if _get_character_class (cluster[0]) == _WIDE or _VARIATION_SELECTOR_16 in cluster or _is_regional_indicator (cluster[0]):
+        return 2
+    return 1
+
+# Get the number of columns text takes up
+def get_text_width (text):
+    if text.isascii ():
+        return len (text)
+    width = 0
+    for cluster in get_clusters (text):
+        width += get_cluster_width (cluster)
+    return width
+
+if __name__ == '__main__':
+    assert (get_clusters ('abc') == 'abc')
+    assert (get_clusters ('e\u0301x') == ['e\u0301', 'x'])
+    assert (get_clusters ('❤\uFE0F!') == ['❤\uFE0F', '!'])
+    assert (get_clusters ('\U0001F44D\U0001F3FD') == ['\U0001F44D\U0001F3FD'])
+    assert (get_clusters ('\U0001F468\u200D\U0001F469\u200D\U0001F467x') == ['\U0001F468\u200D\U0001F469\u200D\U0001F467', 'x'])
+    assert (get_clusters ('\U0001F1F3\U0001F1FF\U0001F1E6\U0001F1FA\U0001F1E6') == ['\U0001F1F3\U0001F1FF', '\U0001F1E6\U0001F1FA', '\U0001F1E6'])
+    assert (get_clusters ('\u1100\u1161\u11A8') == ['\u1100\u1161\u11A8'])
+
+    assert (get_cluster_width ('a') == 1)
+    assert (get_cluster_width ('e\u0301') == 1)
+    assert (get_cluster_width ('中') == 2)
+    assert (get_cluster_width ('❤') == 1)
+    assert (get_cluster_width ('❤\uFE0F') == 2)
+    assert (get_cluster_width ('\U0001F44D\U0001F3FD') == 2)
+    assert (get_cluster_width ('\U0001F1F3\U0001F1FF') == 2)
+    assert (get_cluster_width ('\U00020000') == 2)
+    assert (get_text_width ('abc') == 3)
+    assert (get_text_width ('a中e\u0301\U0001F468\u200D\U0001F469') == 6)
+
+    assert (is_boundary ('a', 'b'))
+    assert (not is_boundary ('a', '\u0301'))
+    assert (not is_boundary ('\u200D', '\U0001F469'))
+    for code in (0x41, 0x300, 0x4E2D, 0x1F600, 0x1F3FB, 0xFE0F, 0x10000, 0xE0041, 0xE0100):
+        assert (_get_character_class (chr (code)) == _get_class (code))
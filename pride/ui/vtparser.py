@@ -0,0 +1,192 @@
+# Copyright (C) 2018 Robert Ancell
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version. See http://www.gnu.org/copyleft/gpl.html the full text of the
+# license.
+
+import codecs
+import re
+
+# Parser states, from https://vt100.net/emu/dec_ansi_parser
+_GROUND = 0
+_ESCAPE = 1
+_ESCAPE_INTERMEDIATE = 2
+_CSI_ENTRY = 3
+_CSI_PARAM = 4
+_CSI_INTERMEDIATE = 5
+_CSI_IGNORE = 6
+_OSC_STRING = 7
+_IGNORED_STRING = 8 # DCS, SOS, PM and APC strings aren't used
+_N_STATES = 9
+
+# Actions done on each byte
+_IGNORE = 0
+_EXECUTE = 1
+_COLLECT = 2
+_PARAM = 3
+_ESC_DISPATCH = 4
+_CSI_DISPATCH = 5
+_OSC_PUT = 6
+
+# Most sequences have only a few parameters, stop ones that would use lots of memory
+_MAX_PARAMS = 16
+
+# Printable text, which is sent in one go. Bytes above 0x7F are UTF-8, not C1 controls.
+_TEXT_RE = re.compile (b'[\x20-\x7E\x80-\xFF]+')
+
+_C0 = list (range (0x00, 0x18)) + [ 0x19 ] + list (range (0x1C, 0x20))
+
+# Build the transitions for each state and byte as (action, next state)
+def _make_table ():
+    table = [ [ (_IGNORE, state) ] * 256 for state in range (_N_STATES) ]
+    def add (state, codes, action, next_state = None):
+        if next_state is None:
+            next_state = state
+        for code in codes:
+            table[state][code] = (action, next_state)
+
+    add (_ESCAPE, _C0, _EXECUTE)
+    add (_ESCAPE, range (0x20, 0x30), _COLLECT, _ESCAPE_INTERMEDIATE)
+    add (_ESCAPE, range (0x30, 0x7F), _ESC_DISPATCH, _GROUND)
+    add (_ESCAPE, [ 0x5B ], _IGNORE, _CSI_ENTRY)
+    add (_ESCAPE, [ 0x5D ], _IGNORE, _OSC_STRING)
+    add (_ESCAPE, [ 0x50, 0x58, 0x5E, 0x5F ], _IGNORE, _IGNORED_STRING)
+
+    add (_ESCAPE_INTERMEDIATE, _C0, _EXECUTE)
+    add (_ESCAPE_INTERMEDIATE, range (0x20, 0x30), _COLLECT)
+    add (_ESCAPE_INTERMEDIATE, range (0x30, 0x7F), _ESC_DISPATCH, _GROUND)
+
+    add (_CSI_ENTRY, _C0, _EXECUTE)
+    add (_CSI_ENTRY, range (0x20, 0x30), _COLLECT, _CSI_INTERMEDIATE)
+    add (_CSI_ENTRY, list (range (0x30, 0x3A)) + [ 0x3B ], _PARAM, _CSI_PARAM)
+    add (_CSI_ENTRY, [ 0x3A ], _IGNORE, _CSI_IGNORE)
+    add (_CSI_ENTRY, range (0x3C, 0x40), _COLLECT, _CSI_PARAM)
+    add (_CSI_ENTRY, range (0x40, 0x7F), _CSI_DISPATCH, _GROUND)
+
+    add (_CSI_PARAM, _C0, _EXECUTE)
+    add (_CSI_PARAM, range (0x20, 0x30), _COLLECT, _CSI_INTERMEDIATE)
+    add (_CSI_PARAM, list (range (0x30, 0x3A)) + [ 0x3B ], _PARAM)
+    add (_CSI_PARAM, [ 0x3A, 0x3C, 0x3D, 0x3E, 0x3F ], _IGNORE, _CSI_IGNORE)
+    add (_CSI_PARAM, range (0x40, 0x7F), _CSI_DISPATCH, _GROUND)
+
+    add (_CSI_INTERMEDIATE, _C0, _EXECUTE)
+    add (_CSI_INTERMEDIATE, range (0x20, 0x30), _COLLECT)
+    add (_CSI_INTERMEDIATE, range (0x30, 0x40), _IGNORE, _CSI_IGNORE)
+    add (_CSI_INTERMEDIATE, range (0x40, 0x7F), _CSI_DISPATCH, _GROUND)
+
+    add (_CSI_IGNORE, _C0, _EXECUTE)
+    add (_CSI_IGNORE, range (0x40, 0x7F), _IGNORE, _GROUND)
+
+    add (_OSC_STRING, range (0x20, 0x100), _OSC_PUT)
+    add (_OSC_STRING, [ 0x07 ], _IGNORE, _GROUND) # BEL ends the string in xterm
+
+    add (_GROUND, _C0, _EXECUTE)
+
+    # These work in any state
+    for state in range (_N_STATES):
+        add (state, [ 0x18, 0x1A ], _EXECUTE, _GROUND)
+        add (state, [ 0x1B ], _IGNORE, _ESCAPE)
+
+    return table
+
+_TABLE = _make_table ()
+
+# Parses the output of programs for text and control sequences.
+# Text is decoded as UTF-8 and passed to print_callback (text), control
+# characters to execute_callback (code), escape sequences to
+# esc_callback (final, intermediates), control sequences to
+# csi_callback (final, params, intermediates) and operating system commands
+# to osc_callback (text). Parameters that aren't given are 0.
+class VTParser:
+    def __init__ (self, print_callback, execute_callback, esc_callback, csi_callback, osc_callback):
+        self.print_callback = print_callback
+        self.execute_callback = execute_callback
+        self.esc_callback = esc_callback
+        self.csi_callback = csi_callback
+        self.osc_callback = osc_callback
+        self.state = _GROUND
+        self.decoder = codecs.getincrementaldecoder ('utf-8') (errors = 'replace')
+        self.intermediates = ''
+        self.params = []
+        self.osc_data = bytearray ()
+
+    def _enter (self, state):
+        if self.state == _OSC_STRING:
+            self.osc_callback (self.osc_data.decode ('utf-8', errors = 'replace'))
+        self.state = state
+        if state in (_ESCAPE, _CSI_ENTRY):
+            self.intermediates = ''
+            self.params = []
+        elif state == _OSC_STRING:
+            self.osc_data = bytearray ()
+
+    def feed (self, data):
+        table = _TABLE
+        length = len (data)
+        i = 0
+        while i < length:
+            if self.state == _GROUND:
+                match = _TEXT_RE.match (data, i)
+                if match is not None:
+                    text = self.decoder.decode (match.group ())
+                    if text != '':
+                        self.print_callback (text)
+                    i = match.end ()
+                    continue
+
+            code = data[i]
+            i += 1
+            (action, state) = table[self.state][code]
+            if action == _EXECUTE:
+                self.execute_callback (code)
+            elif action == _COLLECT:
+                self.intermediates += chr (code)
+            elif action == _PARAM:
+                if code == 0x3B: # ;
+                    if len (self.params) == 0:
+                        self.params.append (0)
+                    if len (self.params) < _MAX_PARAMS:
+                        self.params.append (0)
+                else:
+                    if len (self.params) == 0:
+                        self.params.append (0)
+                    self.params[-1] = self.params[-1] * 10 + code - 0x30
+            elif action == _ESC_DISPATCH:
+                self.esc_callback (chr (code), self.intermediates)
+            elif action == _CSI_DISPATCH:
+                self.csi_callback (chr (code), self.params, self.intermediates)
+            elif action == _OSC_PUT:
+                self.osc_data.append (code)
+            if state != self.state or code == 0x1B:
+                self._enter (state)
+
+if __name__ == '__main__':
+    events = []
+    parser = VTParser (lambda text: events.append (('print', text)),
+                       lambda code: events.append (('execute', code)),
+                       lambda final, intermediates: events.append (('esc', final, intermediates)),
+                       lambda final, params, intermediates: events.append (('csi', final, list (params), intermediates)),
+                       lambda text: events.append (('osc', text)))
+    def check (data, expected):
+        events.clear ()
+        for d in data:
+            parser.feed (d)
+        assert (events == expected), events
+
+    check ([ b'Hello\r\n' ], [ ('print', 'Hello'), ('execute', 0x0D), ('execute', 0x0A) ])
+    check ([ '中é'.encode () ], [ ('print', '中é') ])
+    check ([ '中'.encode ()[:2], '中'.encode ()[2:] ], [ ('print', '中') ])
+    check ([ b'\x1b[H\x1b[2J' ], [ ('csi', 'H', [], ''), ('csi', 'J', [2], '') ])
+    check ([ b'\x1b[1', b'2;', b'34Hx' ], [ ('csi', 'H', [12, 34], ''), ('print', 'x') ])
+    check ([ b'\x1b[;5H' ], [ ('csi', 'H', [0, 5], '') ])
+    check ([ b'\x1b[?25l' ], [ ('csi', 'l', [25], '?') ])
+    check ([ b'\x1b[1\nA' ], [ ('execute', 0x0A), ('csi', 'A', [1], '') ])
+    check ([ b'\x1b[1:2mA' ], [ ('print', 'A') ])
+    check ([ b'\x1b(B\x1b7' ], [ ('esc', 'B', '('), ('esc', '7', '') ])
+    check ([ b'\x1b]0;Title\x07A' ], [ ('osc', '0;Title'), ('print', 'A') ])
+    check ([ b'\x1b]0;T', b'itle\x1b\\A' ], [ ('osc', '0;Title'), ('esc', '\\', ''), ('print', 'A') ])
+    check ([ b'\x1bPq#0\x1b\\A' ], [ ('esc', '\\', ''), ('print', 'A') ])
+    check ([ b'\x1b[12\x18A' ], [ ('execute', 0x18), ('print', 'A') ])
+    check ([ b'\x1b[' + b';' * 100 + b'm' ], [ ('csi', 'm', [0] * _MAX_PARAMS, '') ])
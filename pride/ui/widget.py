@@ -8,26 +8,62 @@
 
 from .characterinputevent import CharacterInputEvent
 from .focusevent import FocusEvent
-from .frame import Frame
 from .keyinputevent import KeyInputEvent
 
 class Widget:
     def __init__ (self):
+        self.parent = None
         self.visible = True
+        # Set if this widget draws every cell in its area, so nothing under it needs to be drawn
+        self.opaque = False
         self.x_align = 0.5
         self.x_scale = 0.0
         self.y_align = 0.5
         self.y_scale = 0.0
         self.has_focus = False
         self._child_frame = None
+        self._child_frame_key = None
+        self._frame = None
+        self._background = None
+        self._dirty = True
+        self._child_dirty = False
+
+    def set_visible (self, visible):
+        if self.visible == visible:
+            return
+        self.visible = visible
+        self.invalidate_size ()
 
     def set_align (self, x_align, y_align):
         self.x_align = x_align
         self.y_align = y_align
+        self.invalidate_size ()
 
     def set_scale (self, x_scale, y_scale):
         self.x_scale = x_scale
         self.y_scale = y_scale
+        self.invalidate_size ()
+
+    # Mark this widget as needing to be rendered again
+    def invalidate (self):
+        if self._dirty:
+            return
+        self._dirty = True
+        if self.parent is not None:
+            self.parent._child_invalidated (self)
+
+    # Mark this widget as having changed size or visibility, so the parent needs to lay it out again
+    def invalidate_size (self):
+        self._dirty = True
+        if self.parent is not None:
+            self.parent.invalidate_size ()
+
+    def _child_invalidated (self, child):
+        if self._dirty or self._child_dirty:
+            return
+        self._child_dirty = True
+        if self.parent is not None:
+            self.parent._child_invalidated (self)
 
     def get_size (self):
         return (0, 0)
@@ -57,22 +93,76 @@ class Widget:
     def render (self, frame, theme):
         pass
 
-    def render_aligned (self, frame, theme):
+    # Draw what is under the children of this widget into frame, an area inside this widget.
+    # This lets a child be rendered again without rendering this widget.
+    def render_background (self, frame, theme):
+        if self._background is not None:
+            (x, y, _, _) = frame.get_area ()
+            (background_x, background_y, _, _) = self._frame.get_area ()
+            frame.set_cells (self._background, x - background_x, y - background_y)
+        elif self.parent is not None:
+            self.parent.render_background (frame, theme)
+
+    # Get the area this widget uses when given an area of width x height, as (x, y, width, height)
+    def get_aligned_area (self, frame_width, frame_height):
         (width, height) = self.get_size ()
-        width = min (width, frame.width)
-        height = min (height, frame.height)
-        used_width = width + int ((frame.width - width) * self.x_scale)
-        used_height = height + int ((frame.height - height) * self.y_scale)
-        x_offset = int ((frame.width - used_width) * self.x_align)
-        y_offset = int ((frame.height - used_height) * self.y_align)
+        width = min (width, frame_width)
+        height = min (height, frame_height)
+        used_width = width + int ((frame_width - width) * self.x_scale)
+        used_height = height + int ((frame_height - height) * self.y_scale)
+        x_offset = int ((frame_width - used_width) * self.x_align)
+        y_offset = int ((frame_height - used_height) * self.y_align)
+        return (x_offset, y_offset, used_width, used_height)
 
-        if (used_width, used_height) == (frame.width, frame.height):
-            self.render (frame, theme)
+    # Render only the children that have changed since they were last rendered
+    def render_children (self, frame, theme, force = False):
+        pass
+
+    # Render this widget if it has changed, or always if force is set
+    def render_aligned (self, frame, theme, force = True):
+        full = force or self._dirty
+        if not full and not self._child_dirty:
             return
+        self._dirty = False
+        self._child_dirty = False
+
+        (x_offset, y_offset, used_width, used_height) = self.get_aligned_area (frame.width, frame.height)
+        if (used_width, used_height) == (frame.width, frame.height):
+            child_frame = frame
+        else:
+            key = (frame, x_offset, y_offset, used_width, used_height)
+            if self._child_frame is None or self._child_frame_key != key:
+                self._child_frame = frame.get_view (x_offset, y_offset, used_width, used_height)
+                self._child_frame_key = key
+            child_frame = self._child_frame
+        if child_frame is not self._frame:
+            self._frame = child_frame
+            force = True
+            full = True
+
+        if full:
+            # Restore what is under this widget when rendering it again without rendering the parent.
+            # Opaque widgets draw over all of it so don't need this. Children that overlap others keep
+            # a copy of it, otherwise the parent draws it again.
+            if self.opaque:
+                self._background = None
+            elif self.parent is not None and self.parent.overlapping_children:
+                if force:
+                    self._background = child_frame.copy_cells ()
+                else:
+                    child_frame.set_cells (self._background)
+            else:
+                self._background = None
+                if not force and self.parent is not None:
+                    self.parent.render_background (child_frame, theme)
+            child_frame.add_damage ()
+            child_frame.cursor = None
+            self.render (child_frame, theme)
+        else:
+            self.render_children (child_frame, theme)
 
-        if self._child_frame is None or (self._child_frame.width, self._child_frame.height) != (used_width, used_height):
-            self._child_frame = Frame (used_width, used_height)
-        self.render (self._child_frame, theme)
-        frame.composite (x_offset, y_offset, self._child_frame)
-        if self._child_frame.cursor is not None:
-            frame.cursor = (self._child_frame.cursor[0] + x_offset, self._child_frame.cursor[1] + y_offset)
+        if child_frame is not frame:
+            if child_frame.cursor is not None:
+                frame.cursor = (child_frame.cursor[0] + x_offset, child_frame.cursor[1] + y_offset)
+            else:
+                frame.cursor = None